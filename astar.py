@@ -2,16 +2,15 @@ import spark_dsg as dsg
 import pathlib
 import numpy as np
 import time
-from dataclasses import dataclass, field
-from typing import Any
-from queue import PriorityQueue
+import heapq
+from compiled_graph import CompiledGraph
+from planner_stats import PlannerStats, phase
 
 
-@dataclass(order=True)
-class PrioritizedNode:
-    # data wrapper class so that the nodes don't get compared
-    node: Any=field(compare=False)
-    priority: float
+class NoPathError(Exception):
+    # the planners' "goal not reachable", every other exception is a bug or bad input
+    pass
+
 
 def bad_heuristic(node1, node2):
     # mimics djikstra
@@ -20,97 +19,443 @@ def bad_heuristic(node1, node2):
 def node_dist(node1, node2):
     return np.linalg.norm(node1.attributes.position[:2] - node2.attributes.position[:2], ord=2)
 
+def as_node(G, node, stats=None):
+    # convert input from node.id.value to node, or to a dense index for a CompiledGraph
+    if isinstance(G, CompiledGraph):
+        return G.resolve(node)
+    if isinstance(node, int):
+        if stats is not None:
+            stats.get_node_calls += 1
+        return G.get_node(node)
+    return node
+
+def node_layer(G, node):
+    if isinstance(G, CompiledGraph):
+        return G.layers[node]
+    return node.layer
+
+def parent_of(G, node, stats=None):
+    if isinstance(G, CompiledGraph):
+        return int(G.parents[node])
+    if stats is not None:
+        stats.get_node_calls += 1
+    return G.get_node(node.get_parent())
+
+def has_parent(G, node):
+    if isinstance(G, CompiledGraph):
+        return bool(G.parents[node] >= 0)
+    return node.has_parent()
+
+def children_of(G, node):
+    # children as something to test membership of nodes with
+    if isinstance(G, CompiledGraph):
+        return set(G.children(node).tolist())
+    return node.children()
+
+def node_key(G, node):
+    # what children_of contains for node
+    if isinstance(G, CompiledGraph):
+        return node
+    return node.id.value
+
+def expand(G, node, stats=None):
+    # (neighbor, edge cost) pairs of node
+    if isinstance(G, CompiledGraph):
+        return G.neighbors(node)
+    siblings = node.siblings()
+    if stats is not None:
+        stats.get_node_calls += len(siblings)
+    neighbor_nodes = map(G.get_node, siblings) # convert the long numbers to nodes
+    return ((neighbor_node, node_dist(node, neighbor_node)) for neighbor_node in neighbor_nodes)
+
+def ancestor_of(G, node, layer, stats=None):
+    # ancestor of node in layer (node itself if it lies in layer), None if it has none
+    if isinstance(G, CompiledGraph):
+        ancestor = G.ancestors(layer)[node]
+        return None if ancestor < 0 else ancestor
+    while node.layer != layer:
+        if not node.has_parent():
+            return None
+        node = parent_of(G, node, stats)
+    return node
+
+def corridor_neighbors(G, corridor, layer, stats=None):
+    # expand() restricted to the nodes whose ancestor in layer is in corridor (a set of node_key)
+    if isinstance(G, CompiledGraph):
+        ancestors = G.ancestors(layer)
+        return lambda node: [(neighbor, edge_cost) for neighbor, edge_cost in G.neighbors(node) if ancestors[neighbor] in corridor]
+    keys = {}  # node.id.value -> node_key of its ancestor, one parent walk per node
+    def in_corridor(node):
+        if node.id.value not in keys:
+            ancestor = ancestor_of(G, node, layer, stats)
+            keys[node.id.value] = None if ancestor is None else node_key(G, ancestor)
+        return keys[node.id.value] in corridor
+    return lambda node: [(neighbor, edge_cost) for neighbor, edge_cost in expand(G, node, stats) if in_corridor(neighbor)]
+
+def bind_heuristic(G, heuristic):
+    # heuristics are written for spark_dsg nodes, map them onto dense indices
+    if not isinstance(G, CompiledGraph):
+        return heuristic
+    if hasattr(heuristic, "bind"):
+        return heuristic.bind(G)
+    if heuristic is node_dist:
+        return G.node_dist
+    if heuristic is bad_heuristic:
+        return bad_heuristic
+    return lambda idx1, idx2: heuristic(G.node(idx1), G.node(idx2))
+
+def heuristic_to(G, heuristic, goal_nodes):
+    # cost-to-go estimate towards the closest of goal_nodes as a function of one node, evaluated
+    # lazily, one node at a time, for the nodes the search generates and memoized, so it costs
+    # as much as the search and not as the map. Single goals use the scalar bind() form: one
+    # vectorized call for the few neighbors of an expansion costs more than scalar calls
+    # (about 2x slower on the test graph). With several goals on a CompiledGraph, heuristics
+    # with a vectorized batch(C, nodes, goal) (and node_dist) give the min over all goals in
+    # one call per node (heuristics are symmetric).
+    if isinstance(G, CompiledGraph) and len(goal_nodes) > 1 and (heuristic is node_dist or hasattr(heuristic, "batch")):
+        goals = np.asarray(goal_nodes, dtype=np.int64)
+        batch = G.node_dists if heuristic is node_dist else lambda nodes, node: heuristic.batch(G, nodes, node)
+        estimate = lambda node: float(np.min(batch(goals, node)))
+    else:
+        heuristic = bind_heuristic(G, heuristic)
+        if len(goal_nodes) == 1:
+            goal_node = goal_nodes[0]
+            estimate = lambda node: heuristic(node, goal_node)
+        else:
+            estimate = lambda node: min(heuristic(node, goal_node) for goal_node in goal_nodes)
+    memo = {}
+    def to_go(node):
+        value = memo.get(node)
+        if value is None:
+            value = memo[node] = estimate(node)
+        return value
+    return to_go
+
 def get_info(goal_node, path_dict, cost_to_come):
     # returns usable information from dictionary
+    if goal_node not in path_dict:
+        raise NoPathError("Goal node not reachable from start node")
     path_list = [goal_node]
     node = path_dict[goal_node]
-    while node != None:
-        path_list.insert(0, node)
+    while node is not None:
+        path_list.append(node)
         node = path_dict[node]
+    path_list.reverse()
     
     return path_list, cost_to_come[goal_node]
 
-def layer_astar(G, start_node, goal_node, heuristic):
-    # convert input from node.id.value to node
-    if isinstance(start_node, int):
-        start_node = G.get_node(start_node)
-    if isinstance(goal_node, int):
-        goal_node = G.get_node(goal_node)
+def astar_search(G, start_node, is_goal, heuristic, neighbors=None, stats=None):
+    # shared single-threaded A* core, heuristic(node) estimates the cost to go
+    # heap entries are (f, tiebreak, node) so nodes never get compared, entries of
+    # already closed nodes are stale and skipped when popped (lazy deletion)
+    # neighbors(node) overrides the (neighbor, edge cost) pairs taken from G
+    # stats: optional PlannerStats, the counters are added once the search ends
+    if neighbors is None:
+        neighbors = lambda node: expand(G, node, stats)
+    Q = [(heuristic(start_node), 0, start_node)] # min cost_to_come + heuristic_cost_to_go priority queue
+    path_dict = {start_node: None}
+    cost_to_come = {start_node: 0.}
+    closed = set()
+    tiebreak = 1
+
+    while Q:
+        _, _, curr_node = heapq.heappop(Q)
+        if curr_node in closed:
+            continue
+        if is_goal(curr_node):
+            if stats is not None:
+                stats.add_search(len(closed), tiebreak, tiebreak - len(Q) - 1)
+            return curr_node, path_dict, cost_to_come
+        closed.add(curr_node)
+        curr_cost = cost_to_come[curr_node]
+        for neighbor_node, edge_cost in neighbors(curr_node):
+            if neighbor_node in closed:
+                continue
+            cost = curr_cost + edge_cost
+            if cost < cost_to_come.get(neighbor_node, np.inf):
+                cost_to_come[neighbor_node] = cost
+                path_dict[neighbor_node] = curr_node
+                heapq.heappush(Q, (cost + heuristic(neighbor_node), tiebreak, neighbor_node))
+                tiebreak += 1
     
-    if start_node.layer != goal_node.layer:
-        raise Exception("Start and goal not on the same layer")
+    if stats is not None:
+        stats.add_search(len(closed), tiebreak, tiebreak)
+    return None, path_dict, cost_to_come
 
-    Q = PriorityQueue() # min cost_to_come + heuristic_cost_to_go priority queue
-    path_dict = {} 
-    cost_to_come = {}
-    Q.put(PrioritizedNode(start_node, 0.))
-    path_dict[start_node] = None
-    cost_to_come[start_node] = 0.
+def bidirectional_astar_search(G, start_node, goal_node, to_goal, to_start, neighbors=None, stats=None):
+    # A* from both ends at once with balanced potentials: the forward search orders nodes by
+    # g + p(node), the backward search by g - p(node), p = (to_goal(node) - to_start(node)) / 2.
+    # With a consistent heuristic both are Dijkstra searches on nonnegative reduced costs, so the
+    # best start-goal cost seen so far is optimal once the two smallest keys add up to it.
+    if neighbors is None:
+        neighbors = lambda node: expand(G, node, stats)
+    potential = lambda node: (to_goal(node) - to_start(node)) / 2.
+    forward = {"Q": [(potential(start_node), 0, start_node)], "sign": 1.,
+               "path_dict": {start_node: None}, "cost_to_come": {start_node: 0.}, "closed": set()}
+    backward = {"Q": [(-potential(goal_node), 0, goal_node)], "sign": -1.,
+                "path_dict": {goal_node: None}, "cost_to_come": {goal_node: 0.}, "closed": set()}
+    best_cost, meeting_node = (0., start_node) if start_node == goal_node else (np.inf, None)
+    tiebreak = 1
 
-    while not Q.empty():
-        curr_node = Q.get().node
-        if curr_node == goal_node:
+    while forward["Q"] and backward["Q"]:
+        if forward["Q"][0][0] + backward["Q"][0][0] >= best_cost:
             break
-        for node_value in curr_node.siblings():
-            neighbor_node = G.get_node(node_value) # convert the long number to node
-            cost = cost_to_come[curr_node] + node_dist(curr_node, neighbor_node)
-            if neighbor_node not in cost_to_come or cost < cost_to_come[neighbor_node]:
-                cost_to_come[neighbor_node] = cost
-                priority = cost + heuristic(neighbor_node, goal_node)
-                Q.put(PrioritizedNode(neighbor_node, priority))
-                path_dict[neighbor_node] = curr_node
+        # expand the smaller frontier
+        search, other = (forward, backward) if len(forward["Q"]) <= len(backward["Q"]) else (backward, forward)
+        _, _, curr_node = heapq.heappop(search["Q"])
+        if curr_node in search["closed"]:
+            continue
+        search["closed"].add(curr_node)
+        curr_cost = search["cost_to_come"][curr_node]
+        for neighbor_node, edge_cost in neighbors(curr_node):
+            if neighbor_node in search["closed"]:
+                continue
+            cost = curr_cost + edge_cost
+            if cost < search["cost_to_come"].get(neighbor_node, np.inf):
+                search["cost_to_come"][neighbor_node] = cost
+                search["path_dict"][neighbor_node] = curr_node
+                if cost + other["cost_to_come"].get(neighbor_node, np.inf) < best_cost:
+                    best_cost = cost + other["cost_to_come"][neighbor_node]
+                    meeting_node = neighbor_node
+                # the rest of any path through a node the other side has closed is already known
+                if neighbor_node not in other["closed"]:
+                    heapq.heappush(search["Q"], (cost + search["sign"] * potential(neighbor_node), tiebreak, neighbor_node))
+                    tiebreak += 1
+
+    if stats is not None:
+        pushes = tiebreak + 1  # both searches start with one entry
+        stats.add_search(len(forward["closed"]) + len(backward["closed"]), pushes, pushes - len(forward["Q"]) - len(backward["Q"]))
+    if meeting_node is None:
+        return None, forward["path_dict"], forward["cost_to_come"]
+    # join the two half paths at the meeting node
+    path_list, _ = get_info(meeting_node, forward["path_dict"], forward["cost_to_come"])
+    node = backward["path_dict"][meeting_node]
+    while node is not None:
+        path_list.append(node)
+        node = backward["path_dict"][node]
+    path_list = remove_loops(path_list)
+    path_dict = {path_list[0]: None}
+    cost_to_come = {path_list[0]: 0.}
+    for prev_node, node in zip(path_list[:-1], path_list[1:]):
+        path_dict[node] = prev_node
+        cost_to_come[node] = cost_to_come[prev_node] + dict(neighbors(prev_node))[node]
+    return goal_node, path_dict, cost_to_come
+
+def remove_loops(path_list):
+    # cuts every detour that comes back to an earlier node of the path
+    first_index = {}
+    result = []
+    for node in path_list:
+        if node in first_index:
+            for removed in result[first_index[node] + 1:]:
+                del first_index[removed]
+            del result[first_index[node] + 1:]
+        else:
+            first_index[node] = len(result)
+            result.append(node)
+    return result
+
+def layer_astar(G, start_node, goal_node, heuristic, bidirectional=False, neighbors=None, stats=None):
+    # neighbors: optional replacement of expand(G, node), e.g. corridor_neighbors
+    start_node = as_node(G, start_node, stats)
+    goal_node = as_node(G, goal_node, stats)
     
+    if node_layer(G, start_node) != node_layer(G, goal_node):
+        raise Exception("Start and goal not on the same layer")
+
+    if bidirectional:
+        with phase(stats, "heuristic"):
+            to_goal, to_start = heuristic_to(G, heuristic, [goal_node]), heuristic_to(G, heuristic, [start_node])
+        with phase(stats, "search"):
+            _, path_dict, cost_to_come = bidirectional_astar_search(G, start_node, goal_node, to_goal, to_start, neighbors, stats)
+        return goal_node, path_dict, cost_to_come
+    with phase(stats, "heuristic"):
+        to_goal = heuristic_to(G, heuristic, [goal_node])
+    with phase(stats, "search"):
+        _, path_dict, cost_to_come = astar_search(G, start_node, lambda node: node == goal_node, to_goal, neighbors, stats)
     return goal_node, path_dict, cost_to_come
 
-def naive_place_to_room_astar(G, start_node, goal_room, heuristic):
-    # convert input from node.id.value to node
-    if isinstance(start_node, int):
-        start_node = G.get_node(start_node)
-    if isinstance(goal_room, int):
-        goal_room = G.get_node(goal_room)
+def anytime_layer_astar(G, start_node, goal_node, heuristic, epsilon=3., epsilon_step=0.5, deadline=None, stats=None):
+    # ARA*: weighted A* with inflation epsilon, yields (path_list, cost, bound) after every
+    # search, where cost <= bound * optimal cost. Every following search
+    # lowers epsilon and reuses the previous one (nodes that improved after being closed
+    # are kept aside and queued again), the last path yielded with epsilon = 1 is optimal.
+    # deadline: time.perf_counter() value after which the search stops early
+    start_node = as_node(G, start_node, stats)
+    goal_node = as_node(G, goal_node, stats)
     
-    if start_node.layer != 3:
-        raise Exception("Start node is not a place")
-    if goal_room.layer != 4:
-        raise Exception("Goal node is not a room")
+    if node_layer(G, start_node) != node_layer(G, goal_node):
+        raise Exception("Start and goal not on the same layer")
+
+    with phase(stats, "heuristic"):
+        to_goal = heuristic_to(G, heuristic, [goal_node])
+    path_dict = {start_node: None}
+    cost_to_come = {start_node: 0.}
+    open_nodes = {start_node}
+    inconsistent = set()
+    tiebreak = 0
+    while True:
+        Q = [(cost_to_come[node] + epsilon * to_goal(node), tiebreak + i, node) for i, node in enumerate(open_nodes | inconsistent)]
+        tiebreak += len(Q)
+        heapq.heapify(Q)
+        closed = set()
+        inconsistent = set()
+        pushes, pops = len(Q), 0
+        # improve the path until no queued node can lead to a cheaper one at this epsilon
+        with phase(stats, "search"):
+            while Q and Q[0][0] < cost_to_come.get(goal_node, np.inf):
+                if deadline is not None and time.perf_counter() > deadline:
+                    return
+                _, _, curr_node = heapq.heappop(Q)
+                pops += 1
+                if curr_node in closed:
+                    continue
+                closed.add(curr_node)
+                curr_cost = cost_to_come[curr_node]
+                for neighbor_node, edge_cost in expand(G, curr_node, stats):
+                    cost = curr_cost + edge_cost
+                    if cost < cost_to_come.get(neighbor_node, np.inf):
+                        cost_to_come[neighbor_node] = cost
+                        path_dict[neighbor_node] = curr_node
+                        if neighbor_node in closed:
+                            inconsistent.add(neighbor_node)
+                        else:
+                            heapq.heappush(Q, (cost + epsilon * to_goal(neighbor_node), tiebreak, neighbor_node))
+                            tiebreak += 1
+                            pushes += 1
+        if stats is not None:
+            stats.add_search(len(closed), pushes, pops)
+        if goal_node not in cost_to_come:
+            raise NoPathError("Goal node not reachable from start node")
+
+        open_nodes = {node for _, _, node in Q if node not in closed}
+        goal_cost = cost_to_come[goal_node]
+        # suboptimality bound: no remaining path can cost less than the smallest g + h
+        lower_bound = min((cost_to_come[node] + to_goal(node) for node in open_nodes | inconsistent), default=goal_cost)
+        bound = min(epsilon, goal_cost / lower_bound) if lower_bound > 0 else epsilon
+        path_list, _ = get_info(goal_node, path_dict, cost_to_come)
+        yield path_list, goal_cost, max(bound, 1.)
+        if epsilon <= 1. or bound <= 1.:
+            return
+        epsilon = max(1., epsilon - epsilon_step)
+
+def ara_star(G, start_node, goal_node, heuristic, time_budget, epsilon=3., epsilon_step=0.5, stats=None):
+    # best (path_list, cost, bound) anytime_layer_astar finds within time_budget seconds
+    best = None
+    for best in anytime_layer_astar(G, start_node, goal_node, heuristic, epsilon, epsilon_step, time.perf_counter() + time_budget, stats):
+        pass
+    if best is None:
+        raise Exception("No path found within the time budget")
+    return best
+
+def multi_goal_astar(G, start_node, goal_nodes, heuristic, stats=None):
+    # one search towards the cheapest of several goals, the heuristic is the min over the goals
+    start_node = as_node(G, start_node, stats)
+    goal_nodes = [as_node(G, goal_node, stats) for goal_node in goal_nodes]
+    
+    if any(node_layer(G, goal_node) != node_layer(G, start_node) for goal_node in goal_nodes):
+        raise Exception("Start and goals not on the same layer")
+
+    goal_set = set(goal_nodes)
+    with phase(stats, "heuristic"):
+        to_goal = heuristic_to(G, heuristic, goal_nodes)
+    with phase(stats, "search"):
+        curr_node, path_dict, cost_to_come = astar_search(G, start_node, lambda node: node in goal_set, to_goal, stats=stats)
+    if curr_node is None:
+        raise NoPathError("No goal reachable from start node")
+    return curr_node, path_dict, cost_to_come
 
-    path_dict={}
-    cost_to_come={}
+def k_shortest_paths(G, start_node, goal_node, heuristic, k, stats=None):
+    # Yen's algorithm: up to k loopless start-goal paths on one layer as (path_list, cost),
+    # cheapest first. Every new path branches off a previous one at a spur node, the spur
+    # search runs without the root nodes and without the edges previous paths took there.
+    start_node = as_node(G, start_node, stats)
+    goal_node = as_node(G, goal_node, stats)
+    
+    if node_layer(G, start_node) != node_layer(G, goal_node):
+        raise Exception("Start and goal not on the same layer")
 
-    Q = PriorityQueue() # min cost_to_come + heuristic_cost_to_go priority queue
-    Q.put(PrioritizedNode(start_node, 0.))
-    path_dict[start_node] = None
-    cost_to_come[start_node] = 0.
-    goal_room_place_values = goal_room.children()
+    to_goal = heuristic_to(G, heuristic, [goal_node])  # stays admissible with nodes and edges removed
+    def spur_search(spur_node, removed_nodes, removed_edges):
+        spur_key = node_key(G, spur_node)
+        def neighbors(node):
+            node_value = node_key(G, node)
+            return [(neighbor, edge_cost) for neighbor, edge_cost in expand(G, node, stats)
+                    if node_key(G, neighbor) not in removed_nodes and (node_value != spur_key or node_key(G, neighbor) not in removed_edges)]
+        reached, path_dict, cost_to_come = astar_search(G, spur_node, lambda node: node == goal_node, to_goal, neighbors, stats)
+        if reached is None:
+            return None
+        path_list, _ = get_info(reached, path_dict, cost_to_come)
+        return path_list, [cost_to_come[node] for node in path_list]
 
-    while not Q.empty():
-        curr_node = Q.get().node
-        if curr_node.id.value in goal_room_place_values:
+    first = spur_search(start_node, set(), set())
+    if first is None:
+        raise NoPathError("Goal node not reachable from start node")
+    paths = [first]  # (path_list, cost to come along the path)
+    seen = {tuple(node_key(G, node) for node in first[0])}
+    candidates = []  # heap of (cost, tiebreak, path_list, costs)
+    tiebreak = 0
+    while len(paths) < k:
+        prev_path, prev_costs = paths[-1]
+        prev_keys = [node_key(G, node) for node in prev_path]
+        for i in range(len(prev_path) - 1):
+            root_keys = prev_keys[:i + 1]
+            # edges out of the spur node taken by earlier paths with the same root
+            removed_edges = set()
+            for path_list, _ in paths:
+                keys = [node_key(G, node) for node in path_list]
+                if keys[:i + 1] == root_keys and len(keys) > i + 1:
+                    removed_edges.add(keys[i + 1])
+            spur = spur_search(prev_path[i], set(root_keys[:-1]), removed_edges)
+            if spur is None:
+                continue
+            path_list = prev_path[:i] + spur[0]
+            keys = tuple(node_key(G, node) for node in path_list)
+            if keys in seen:
+                continue
+            seen.add(keys)
+            costs = prev_costs[:i] + [prev_costs[i] + cost for cost in spur[1]]
+            heapq.heappush(candidates, (costs[-1], tiebreak, path_list, costs))
+            tiebreak += 1
+        if not candidates:
             break
-        for node_value in curr_node.siblings():
-            neighbor_node = G.get_node(node_value) # convert the long number to node
-            cost = cost_to_come[curr_node] + node_dist(curr_node, neighbor_node)
-            if neighbor_node not in cost_to_come or cost < cost_to_come[neighbor_node]:
-                cost_to_come[neighbor_node] = cost
-                priority = cost + heuristic(neighbor_node, goal_room)
-                Q.put(PrioritizedNode(neighbor_node, priority))
-                path_dict[neighbor_node] = curr_node
+        _, _, path_list, costs = heapq.heappop(candidates)
+        paths.append((path_list, costs))
+    return [(path_list, costs[-1]) for path_list, costs in paths]
+
+def naive_place_to_room_astar(G, start_node, goal_room, heuristic, neighbors=None, stats=None):
+    start_node = as_node(G, start_node, stats)
+    goal_room = as_node(G, goal_room, stats)
     
+    if node_layer(G, start_node) != 3:
+        raise Exception("Start node is not a place")
+    if node_layer(G, goal_room) != 4:
+        raise Exception("Goal node is not a room")
+
+    goal_room_place_values = children_of(G, goal_room)
+    with phase(stats, "heuristic"):
+        to_goal = heuristic_to(G, heuristic, [goal_room])
+    with phase(stats, "search"):
+        curr_node, path_dict, cost_to_come = astar_search(G, start_node, lambda node: node_key(G, node) in goal_room_place_values,
+                                                          to_goal, neighbors, stats)
+    if curr_node is None:
+        raise NoPathError("Goal room not reachable from start node")
     return curr_node, path_dict, cost_to_come
 
-def closest_place_to_room_astar(G, start_node, goal_room, heuristic): # bad
-    # convert input from node.id.value to node
-    if isinstance(start_node, int):
-        start_node = G.get_node(start_node)
-    if isinstance(goal_room, int):
-        goal_room = G.get_node(goal_room)
+def closest_place_to_room_astar(G, start_node, goal_room, heuristic, stats=None): # bad
+    start_node = as_node(G, start_node, stats)
+    goal_room = as_node(G, goal_room, stats)
     
-    if start_node.layer != 3:
+    if node_layer(G, start_node) != 3:
         raise Exception("Start node is not a place")
-    if goal_room.layer != 4:
+    if node_layer(G, goal_room) != 4:
         raise Exception("Goal node is not a room")
 
     # get closest_goal_room_node
+    if isinstance(G, CompiledGraph):
+        room_children = G.children(goal_room)
+        room_node_dists = np.linalg.norm(G.positions[room_children] - G.positions[start_node], ord=2, axis=1)
+        return layer_astar(G, start_node, int(room_children[np.argmin(room_node_dists)]), heuristic, stats=stats)
     idx = 0
     room_node_pos = np.zeros((len(goal_room.children()), 3), dtype=float)
     values = np.zeros(len(goal_room.children()), dtype=int)
@@ -118,36 +463,152 @@ def closest_place_to_room_astar(G, start_node, goal_room, heuristic): # bad
         room_node_pos[idx, :] = G.get_node(value).attributes.position
         values[idx] = value
         idx += 1
-    room_node_dists = np.linalg.norm(room_node_pos, ord=2, axis=1)
+    room_node_dists = np.linalg.norm(room_node_pos - start_node.attributes.position, ord=2, axis=1)
     closest_room_node = G.get_node(values[np.argmin(room_node_dists)])
-    return layer_astar(G, start_node, closest_room_node, heuristic)
+    return layer_astar(G, start_node, closest_room_node, heuristic, stats=stats)
 
 
-def hierarchical_planner(G, start_node, goal_node, heuristic):
-    # convert input from node.id.value to node
-    if isinstance(start_node, int):
-        start_node = G.get_node(start_node)
-    if isinstance(goal_node, int):
-        goal_node = G.get_node(goal_node)
+def hierarchical_segments(G, start_node, goal_node, heuristic, cache=None, incremental=None, bidirectional=False, corridor=False, room_path=None, stats=None):
+    # streaming hierarchical_planner: yields (path_segment, segment_cost) for every room
+    # segment as soon as it is planned, each segment starts at the last node of the previous
+    # one, so the robot can start moving along the first segment while the rest is planned
+    # cache: optional PathCache of G (compiled graph only), turns the room level planning
+    # into a table lookup and reuses in-room search trees across queries. Cached segments stay
+    # in their room, they match the segments planned with corridor=True (see place_to_room)
+    # incremental: optional DStarLite of G towards goal_node, plans the final segment and
+    # keeps its search between calls so graph edits are repaired instead of replanned
+    # bidirectional: plan the final segment with bidirectional A*
+    # corridor: searches of a segment only expand places in its room and the next room of the
+    # room path, and are repeated without that restriction if the corridor holds no path
+    # room_path: rooms to go through (e.g. from k_shortest_paths) instead of the shortest room path
+    # stats: optional PlannerStats, also gets the time, expansions and method of every segment
+    if cache is not None and cache.C is not G:
+        raise Exception("Path cache was built for a different graph")
+    start_node = as_node(G, start_node, stats)
+    goal_node = as_node(G, goal_node, stats)
     # make sure the nodes are places
-    if start_node.layer != 3:
+    if node_layer(G, start_node) != 3:
         raise Exception("Start node is not a place")
-    if goal_node.layer != 3:
+    if node_layer(G, goal_node) != 3:
         raise Exception("Goal node is not a place")
 
     # Room level planning
-    start_room = G.get_node(start_node.get_parent())
-    goal_room = G.get_node(goal_node.get_parent())
-    room_path, _ = get_info(*layer_astar(G, start_room, goal_room, heuristic))
+    start_room = parent_of(G, start_node, stats)
+    goal_room = parent_of(G, goal_node, stats)
+    with phase(stats, "room_level"):
+        if room_path is not None:
+            room_path = [as_node(G, room, stats) for room in room_path]
+            if node_key(G, room_path[0]) != node_key(G, start_room) or node_key(G, room_path[-1]) != node_key(G, goal_room):
+                raise Exception("Room path does not connect the rooms of start and goal")
+        elif cache is None:
+            room_path, _ = get_info(*layer_astar(G, start_room, goal_room, heuristic, stats=stats))
+        else:
+            room_path, _ = cache.room_path(start_room, goal_room)
     # Room to Room planning
-    total_path_list = [start_node]
-    total_cost = 0.
+    curr_node = start_node
     for i in range(len(room_path)):
-        curr_node = total_path_list.pop()
-        if i == len(room_path) - 1:
-            path_segment, segment_cost = get_info(*layer_astar(G, curr_node, goal_node, heuristic))
-        else:
-            path_segment, segment_cost = get_info(*naive_place_to_room_astar(G, curr_node, room_path[i + 1], heuristic))
-        total_path_list.extend(path_segment)
+        if stats is not None:
+            t0, expansions = time.perf_counter_ns(), stats.expansions
+        segment = None
+        if incremental is not None and i == len(room_path) - 1 and incremental.goal == goal_node:
+            incremental.move_start(curr_node)
+            incremental_expansions = incremental.expansions
+            segment, method = incremental.plan(), "incremental"
+            if stats is not None:
+                stats.expansions += incremental.expansions - incremental_expansions
+        elif cache is not None:
+            segment = cache.place_to_place(curr_node, goal_node) if i == len(room_path) - 1 else cache.place_to_room(curr_node, room_path[i + 1], heuristic)
+            method = "cache"
+        if segment is None:
+            if i == len(room_path) - 1:
+                search = lambda neighbors: get_info(*layer_astar(G, curr_node, goal_node, heuristic, bidirectional, neighbors, stats))
+                method = "layer_astar"
+            else:
+                search = lambda neighbors: get_info(*naive_place_to_room_astar(G, curr_node, room_path[i + 1], heuristic, neighbors, stats))
+                method = "place_to_room"
+            if corridor:
+                corridor_rooms = {node_key(G, room) for room in room_path[i:i + 2]}
+                try:
+                    segment = search(corridor_neighbors(G, corridor_rooms, dsg.DsgLayers.ROOMS, stats))
+                    method += "_corridor"
+                except NoPathError:  # corridor disconnected
+                    if stats is not None:
+                        stats.fallbacks += 1
+            if segment is None:
+                segment = search(None)
+        path_segment, segment_cost = segment
+        if stats is not None:
+            segment_time = time.perf_counter_ns() - t0
+            stats.phases["segments"] = stats.phases.get("segments", 0) + segment_time
+            stats.segments.append({"room": room_path[i], "method": method, "time_ns": segment_time,
+                                   "expansions": stats.expansions - expansions, "cost": segment_cost, "length": len(path_segment)})
+        curr_node = path_segment[-1]
+        yield path_segment, segment_cost
+
+
+def hierarchical_planner(G, start_node, goal_node, heuristic, cache=None, incremental=None, bidirectional=False, corridor=False, room_path=None, stats=None):
+    # plans every segment of hierarchical_segments and joins them, see there for the options
+    total_path_list = []
+    total_cost = 0.
+    for path_segment, segment_cost in hierarchical_segments(G, start_node, goal_node, heuristic, cache, incremental, bidirectional, corridor, room_path, stats):
+        # consecutive segments share their end and start node
+        total_path_list.extend(path_segment[1:] if total_path_list else path_segment)
         total_cost += segment_cost
     return total_path_list, total_cost
+
+
+def multilevel_planner(G, start_node, goal_node, heuristic, layers=None, stats=None):
+    # Hierarchical planning over any stack of layers (e.g. places, rooms, buildings): plans on
+    # the highest layer where start and goal both have an ancestor, then refines top-down, each
+    # layer only expanding nodes whose ancestor one layer up lies on the path planned there. If
+    # that corridor holds no path (e.g. rooms adjacent but not connected through their places),
+    # the layer is searched again without it.
+    # layers: layers to plan on, bottom to top, default the layers of the start and its ancestors
+    # from the place layer up. Objects (and agents) below the bottom layer are connected to their
+    # ancestor in the bottom layer, the 2D distance to it is added to the cost.
+    start_node = as_node(G, start_node, stats)
+    goal_node = as_node(G, goal_node, stats)
+    if layers is None:
+        layers = []
+        node = ancestor_of(G, start_node, max(node_layer(G, start_node), dsg.DsgLayers.PLACES), stats)
+        while node is not None:
+            layers.append(node_layer(G, node))
+            node = parent_of(G, node, stats) if has_parent(G, node) else None
+    if len(layers) == 0:
+        raise Exception("Start node has no ancestor in the place layer or above")
+
+    # ancestors of start and goal on every layer, planning starts on the highest layer both have
+    starts = [ancestor_of(G, start_node, layer, stats) for layer in layers]
+    goals = [ancestor_of(G, goal_node, layer, stats) for layer in layers]
+    if starts[0] is None or goals[0] is None:
+        raise Exception("Start or goal has no ancestor in the bottom layer")
+    top = 0
+    while top + 1 < len(layers) and starts[top + 1] is not None and goals[top + 1] is not None:
+        top += 1
+
+    path_list = None
+    for level in range(top, -1, -1):
+        start, goal = starts[level], goals[level]
+        with phase(stats, f"layer_{int(layers[level])}"):
+            to_goal = heuristic_to(G, heuristic, [goal])
+            neighbors = None
+            if level < top:
+                neighbors = corridor_neighbors(G, {node_key(G, node) for node in path_list}, layers[level + 1], stats)
+            reached, path_dict, cost_to_come = astar_search(G, start, lambda node: node == goal, to_goal, neighbors, stats)
+            if reached is None and neighbors is not None:
+                if stats is not None:
+                    stats.fallbacks += 1
+                reached, path_dict, cost_to_come = astar_search(G, start, lambda node: node == goal, to_goal, stats=stats)
+        if reached is None:
+            raise NoPathError("Goal node not reachable from start node")
+        path_list, total_cost = get_info(reached, path_dict, cost_to_come)
+
+    # objects below the bottom layer
+    dist = G.node_dist if isinstance(G, CompiledGraph) else node_dist
+    if node_key(G, start_node) != node_key(G, starts[0]):
+        total_cost += dist(start_node, starts[0])
+        path_list.insert(0, start_node)
+    if node_key(G, goal_node) != node_key(G, goals[0]):
+        total_cost += dist(goals[0], goal_node)
+        path_list.append(goal_node)
+    return path_list, total_cost
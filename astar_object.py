@@ -2,122 +2,84 @@ from astar import *
 import matplotlib.pyplot as plt
 
 
-def nav_to_object(G, start_node, goal_object, method, heuristics):
-    # convert input from node.id.value to node
-    if isinstance(start_node, int):
-        start_node = G.get_node(start_node)
+def build_object_index(G):
+    # object name -> places that instances of the object are attached to, each place once (same
+    # as CompiledGraph.object_places). One pass over the object layer of a DSG, callers that
+    # plan to several objects build it once and pass it on (nav_to_object(object_index=...)).
+    if isinstance(G, CompiledGraph):
+        return G.object_places
+    place_values = {}
+    for obj in G.get_layer(dsg.DsgLayers.OBJECTS).nodes:
+        obj_parent_value = obj.get_parent()
+        if obj_parent_value is None or G.get_node(obj_parent_value).layer != dsg.DsgLayers.PLACES:
+            continue
+        place_values.setdefault(obj.attributes.name, set()).add(obj_parent_value)
+    return {name: [G.get_node(value) for value in sorted(values)] for name, values in place_values.items()}
+
+
+def nav_to_object(G, start_node, goal_object, method, heuristics, object_index=None):
+    # object_index: prebuilt build_object_index(G), built for this call if not given
+    start_node = as_node(G, start_node)
     
-    if start_node.layer != 3:
+    if node_layer(G, start_node) != 3:
         raise Exception("Start node is not a place")
     
-    object_layer = G.get_layer(dsg.DsgLayers.OBJECTS)
-    object_nodes = list(object_layer.nodes)
-    best_place = None
-    best_dist = np.inf
-    for obj in object_nodes:
-        if goal_object == obj.attributes.name:
-            obj_parent_value = obj.get_parent()
-            if obj_parent_value is None:
-                continue
-            place_node = G.get_node(obj_parent_value)
-            dist = node_dist(start_node, place_node)
-            if dist < best_dist:
-                best_place = place_node
-                best_dist = dist
-    if best_place is None:
+    if object_index is None:
+        object_index = build_object_index(G)
+    goal_places = object_index.get(goal_object, [])
+    if len(goal_places) == 0:
         raise Exception("No place found that corresponds to the desired object")
     if method == layer_astar:
-        return get_info(*method(G, start_node, best_place, heuristics))
-    return method(G, start_node, best_place, heuristics)
-
-
-path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
-path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
-
-# node data structure: Node<id=node.id.category(node.id.category_id), layer=node.layer>
-# node.id.value: the long number
-
-G = dsg.DynamicSceneGraph.load(str(path_to_dsg))
-dsg.add_bounding_boxes_to_layer(G, dsg.DsgLayers.ROOMS)
-
-object_layer = G.get_layer(dsg.DsgLayers.OBJECTS)
-object_nodes = list(object_layer.nodes)
-# for obj in object_nodes:
-#     print(obj.attributes.name)
-objects_unique, counts = np.unique([obj.attributes.name for obj in object_nodes], return_counts=True)
-print(f"Unique object list: {objects_unique}")
-print(f"Their counts: {counts}")
-
-
-target_object = "trashcan"
-
-room_layer = G.get_layer(dsg.DsgLayers.ROOMS)
-room_nodes = list(room_layer.nodes)
-# place1 = G.get_node(list(room_nodes[8].children())[0])
-place1 = G.get_node(list(room_nodes[0].children())[20])
-
-print("Testing object navigation (hierarchical_planner)")
-time1 = time.time()
-path_list, total_cost = nav_to_object(G, place1, target_object, hierarchical_planner, node_dist)
-time2 = time.time()
-print(f"Compute time: {time2 - time1} sec")
-print(total_cost)
-print()
-
-print("--- Plotting paths ---")
-start_pos = place1.attributes.position
-places_layer = G.get_layer(dsg.DsgLayers.PLACES)
-object_layer = G.get_layer(dsg.DsgLayers.OBJECTS)
-object_nodes = list(object_layer.nodes)
-plt.figure(figsize=(8, 8))
-
-colors = [
-    "#f4c2c2",  # Light Pink
-    "#ace1af",  # Soft Celadon Green
-    "#add8e6",  # Light Blue
-    "#bdb76b",  # Dark Khaki
-    "#ffe4e1",  # Misty Rose
-    "#77dd77",  # Pastel Green
-    "#fdd5b1",  # Light Apricot
-    "#9f79ee",  # Medium Purple
-    "#cfcfc4"   # Pastel Gray
-]
-node_to_room_color = {}
-for i, room in enumerate(room_layer.nodes):
-    room_color = colors[i]
-    plt.plot(room.attributes.position[0], room.attributes.position[1], "o", color=room_color, markersize=5, alpha=0.8)
-    plt.text(room.attributes.position[0]-0.5, room.attributes.position[1]+0.5, f"$R_{i}$", color=colors[i], alpha=1.0, fontsize=11)  # plot room centroid
-    for node_value in room.children():
-        node = G.get_node(node_value)
-        plt.plot(node.attributes.position[0], node.attributes.position[1], "o", color=room_color, markersize=2, alpha=0.25)
-        node_to_room_color[node_value] = room_color
-for edge in places_layer.edges:
-    edge_color = node_to_room_color.get(edge.source)
-    start = G.get_node(edge.source).attributes.position
-    end = G.get_node(edge.target).attributes.position
-    plt.plot([start[0], end[0]], [start[1], end[1]], color=edge_color, alpha=0.25, linewidth=0.3)
-
-for node in path_list:
-    # Plot the nodes in the path
-    plt.plot(node.attributes.position[0], node.attributes.position[1], "o", color="green", markersize=5)
-for i in range(len(path_list) - 1):
-    # Plot the edges in the path
-    start = path_list[i].attributes.position
-    end = path_list[i + 1].attributes.position
-    plt.plot([start[0], end[0]], [start[1], end[1]], color="green", linewidth=2, label="Hierarchical A* Path" if i == 0 else "")
-
-plt.plot(start_pos[0], start_pos[1], 'x', color='black', markersize=8, label='Start point')
-for obj in object_nodes:
-        if target_object == obj.attributes.name:
-            obj_parent_value = obj.get_parent()
-            if obj_parent_value is None:
-                continue
-            place_node = G.get_node(obj_parent_value)
-            plt.plot(place_node.attributes.position[0], place_node.attributes.position[1], 'x', color='red', markersize=8)            
-
-plt.xlabel("x [m]")
-plt.ylabel("y [m]")
-# plt.title("Hierarchical A* Path to Object")
-plt.legend()
-plt.gca().set_aspect('equal', adjustable='box')  # ensure physical aspect ratio is maintained
-plt.savefig("plots/astar_trashcan.png")
+        # every instance is a goal of the same search, the first one reached is the cheapest
+        return get_info(*multi_goal_astar(G, start_node, goal_places, heuristics))
+    # other planners go to each instance, keep the cheapest
+    return min((method(G, start_node, goal_place, heuristics) for goal_place in goal_places), key=lambda result: result[1])
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    from rendering import draw_graph, draw_paths
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+
+    # nodes are dense indices of the compiled graph, C.ids[idx] is their node.id.value
+
+    C = load_planning_index(path_to_dsg)
+
+    object_nodes = C.layer_nodes(dsg.DsgLayers.OBJECTS)
+    objects_unique, counts = np.unique(C.names[object_nodes], return_counts=True)
+    print(f"Unique object list: {objects_unique}")
+    print(f"Their counts: {counts}")
+
+
+    target_object = "trashcan"
+
+    room_nodes = C.layer_nodes(dsg.DsgLayers.ROOMS)
+    # place1 = int(C.children(room_nodes[8])[0])
+    place1 = int(C.children(room_nodes[0])[20])
+
+    print("Testing object navigation (hierarchical_planner)")
+    time1 = time.time()
+    path_list, total_cost = nav_to_object(C, place1, target_object, hierarchical_planner, node_dist)
+    time2 = time.time()
+    print(f"Compute time: {time2 - time1} sec")
+    print(total_cost)
+    print()
+
+    print("--- Plotting paths ---")
+    start_pos = C.positions[place1]
+    plt.figure(figsize=(8, 8))
+    draw_graph(C)
+    draw_paths(C, [path_list], color="green", label="Hierarchical A* Path")
+
+    plt.plot(start_pos[0], start_pos[1], 'x', color='black', markersize=8, label='Start point')
+    goal_places = C.object_places.get(target_object, [])
+    plt.scatter(C.positions[goal_places, 0], C.positions[goal_places, 1], marker='x', color='red', s=64)
+
+    plt.xlabel("x [m]")
+    plt.ylabel("y [m]")
+    # plt.title("Hierarchical A* Path to Object")
+    plt.legend()
+    plt.gca().set_aspect('equal', adjustable='box')  # ensure physical aspect ratio is maintained
+    plt.savefig("plots/astar_trashcan.png")
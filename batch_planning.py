@@ -0,0 +1,158 @@
+import spark_dsg as dsg
+import numpy as np
+import pathlib
+import time
+import os
+from multiprocessing import Pool
+from concurrent.futures import ProcessPoolExecutor
+from astar import NoPathError, get_info, node_dist, layer_astar, hierarchical_planner, k_shortest_paths, parent_of
+from compiled_graph import CompiledGraph, compile_graph
+from planning_index import load_planning_index
+from planner_stats import PlannerStats
+
+
+_worker_graph = None  # compiled graph of the current worker process
+_worker_planner = (None, None)  # (method, heuristic) sent once to the current worker process
+
+
+def load_compiled(G):
+    # accepts a path to dsg.json, a DSG or an already compiled graph
+    if isinstance(G, CompiledGraph):
+        return G
+    if isinstance(G, (str, pathlib.Path)):
+        return load_planning_index(G)
+    return compile_graph(G)
+
+
+def worker_graph(G):
+    # what the workers of a pool load: a path to dsg.json once its planning index exists (it
+    # is built here, in the parent, so workers never write it concurrently), otherwise the
+    # compiled graph, the spark_dsg graph cannot be sent to the workers
+    if isinstance(G, (str, pathlib.Path)):
+        load_planning_index(G)
+        return G
+    return G if isinstance(G, CompiledGraph) else compile_graph(G)
+
+
+def _init_worker(G, method=None, heuristic=None):
+    # runs once per worker process, afterwards the worker only sees id values. method and
+    # heuristic (e.g. a ContractionHierarchy or landmark tables) are sent here once instead
+    # of with every query
+    global _worker_graph, _worker_planner
+    _worker_graph = load_compiled(G)
+    _worker_planner = (method, heuristic)
+
+
+def _planner(method, heuristic):
+    # (method, heuristic) of a query run in a worker, the worker's own where not given
+    return (_worker_planner[0] if method is None else method), (_worker_planner[1] if heuristic is None else heuristic)
+
+
+def solve(C, start_node, goal_node, method, heuristic):
+    # (path_list, cost) of one query with any of the planners
+    if method == layer_astar:
+        return get_info(*method(C, start_node, goal_node, heuristic))
+    return method(C, start_node, goal_node, heuristic)
+
+
+def plan_query(C, start_value, goal_value, method, heuristic):
+    # one query between node.id.values, the path is returned as node.id.values too
+    path_list, cost = solve(C, C.index_of(start_value), C.index_of(goal_value), method, heuristic)
+    return C.ids[path_list].tolist(), float(cost)
+
+
+def run_queries(C, pairs, method, heuristic):
+    # pairs: (n, 2) array of node.id.value start/goal pairs
+    costs = np.full(len(pairs), np.inf)
+    path_lengths = np.zeros(len(pairs), dtype=int)
+    times = np.zeros(len(pairs))
+    for idx, (start_value, goal_value) in enumerate(pairs):
+        start_node, goal_node = C.index_of(start_value), C.index_of(goal_value)
+        t0 = time.perf_counter_ns()
+        try:
+            path_list, cost = solve(C, start_node, goal_node, method, heuristic)
+        except NoPathError:
+            path_list, cost = [], np.inf
+        times[idx] = (time.perf_counter_ns() - t0) * 1e-9
+        costs[idx] = cost
+        path_lengths[idx] = len(path_list)
+    return costs, path_lengths, times
+
+
+def _run_chunk(pairs):
+    return run_queries(_worker_graph, pairs, *_worker_planner)
+
+
+def _run_query(start_value, goal_value, method=None, heuristic=None):
+    return plan_query(_worker_graph, start_value, goal_value, *_planner(method, heuristic))
+
+
+def _refine(C, start_node, goal_node, heuristic, room_path, corridor, stats=None):
+    # one refinement of k_best_hierarchical_planner with its own stats, merged by the caller
+    return hierarchical_planner(C, start_node, goal_node, heuristic, corridor=corridor, room_path=room_path, stats=stats), stats
+
+
+def _refine_room_path(start_node, goal_node, heuristic, room_path, corridor, stats=None):
+    _, heuristic = _planner(None, heuristic)
+    return _refine(_worker_graph, start_node, goal_node, heuristic, room_path, corridor, stats)
+
+
+def planning_pool(G, workers=None, method=None, heuristic=None):
+    # process pool whose workers hold the compiled graph of G, memory-mapped from the planning
+    # index if G is a path to dsg.json, so queries only send node indices or id values.
+    # method and heuristic are loaded once per worker and used by queries that pass None.
+    return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(worker_graph(G), method, heuristic))
+
+
+def plan_many(G, pairs, method=layer_astar, heuristic=node_dist, workers=None, chunksize=64):
+    # Plans every (start, goal) pair of node.id.values in pairs with method and returns
+    # numpy arrays of costs (inf if no path), path lengths (number of nodes) and compute times.
+    # G is a path to dsg.json, a DSG or a CompiledGraph; with a path every worker memory-maps the
+    # planning index of the DSG (see planning_index.py) instead of receiving a copy of the graph.
+    pairs = np.asarray(pairs, dtype=np.uint64).reshape(-1, 2)
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or len(pairs) <= chunksize:
+        return run_queries(load_compiled(G), pairs, method, heuristic)
+
+    G = worker_graph(G)
+    chunks = [pairs[start:start + chunksize] for start in range(0, len(pairs), chunksize)]
+    with Pool(workers, initializer=_init_worker, initargs=(G, method, heuristic)) as pool:
+        results = pool.map(_run_chunk, chunks)
+    costs, path_lengths, times = (np.concatenate(arrays) for arrays in zip(*results))
+    return costs, path_lengths, times
+
+
+def k_best_hierarchical_planner(C, start_node, goal_node, heuristic, k=3, executor=None, corridor=False, stats=None):
+    # Refines the k shortest room sequences (Yen) with hierarchical_planner and returns the
+    # cheapest (path_list, cost), which avoids committing to a single room path that looks short
+    # on the room layer but is expensive on the places. The refinements run on executor if given:
+    # a ThreadPoolExecutor, or a planning_pool of this same compiled graph. stats also counts
+    # the refinements run on the executor, each collects its own and they are merged here.
+    start_node, goal_node = C.resolve(start_node), C.resolve(goal_node)
+    room_paths = [room_path for room_path, _ in k_shortest_paths(C, parent_of(C, start_node), parent_of(C, goal_node), heuristic, k, stats=stats)]
+    if executor is None:
+        results = []
+        for room_path in room_paths:
+            try:
+                results.append(hierarchical_planner(C, start_node, goal_node, heuristic, corridor=corridor, room_path=room_path, stats=stats))
+            except NoPathError:  # the room path has no path on the places
+                pass
+    else:
+        refine_stats = [None if stats is None else PlannerStats() for _ in room_paths]
+        if isinstance(executor, ProcessPoolExecutor):
+            futures = [executor.submit(_refine_room_path, start_node, goal_node, heuristic, room_path, corridor, refine)
+                       for room_path, refine in zip(room_paths, refine_stats)]
+        else:
+            futures = [executor.submit(_refine, C, start_node, goal_node, heuristic, room_path, corridor, refine)
+                       for room_path, refine in zip(room_paths, refine_stats)]
+        results = []
+        for future in futures:
+            if isinstance(future.exception(), NoPathError):
+                continue
+            result, refine = future.result()
+            results.append(result)
+            if stats is not None:
+                stats.merge(refine)
+    if not results:
+        raise NoPathError("Goal node not reachable from start node")
+    return min(results, key=lambda result: result[1])
@@ -0,0 +1,46 @@
+from astar import *
+from planning_index import load_planning_index
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    N = 200
+    time_budgets = [0.001, 0.002, 0.005, 0.01, 0.02]  # sec
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    # cross-room queries, where the full hierarchical plan takes longest
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    pairs = places[np.random.randint(0, len(places), size=(4 * N, 2))]
+    pairs = pairs[C.rooms[pairs[:, 0]] != C.rooms[pairs[:, 1]]][:N].tolist()
+
+    # time until the robot can start moving vs. time for the whole path
+    first_times = np.zeros(len(pairs))
+    total_times = np.zeros(len(pairs))
+    for idx, (start, goal) in enumerate(pairs):
+        t0 = time.perf_counter()
+        segments = hierarchical_segments(C, start, goal, node_dist)
+        next(segments)
+        first_times[idx] = time.perf_counter() - t0
+        for _ in segments:
+            pass
+        total_times[idx] = time.perf_counter() - t0
+    print(f"--- Streaming hierarchical planner ({len(pairs)}) ---")
+    print(f"First segment time = {np.mean(first_times):.5f} +- {np.std(first_times):.5f} sec")
+    print(f"Full path time = {np.mean(total_times):.5f} +- {np.std(total_times):.5f} sec")
+    print()
+
+    optimal_costs = np.array([get_info(*layer_astar(C, start, goal, node_dist))[1] for start, goal in pairs])
+    print(f"--- ARA* within a time budget ({len(pairs)}) ---")
+    for time_budget in time_budgets:
+        cost_ratios = []
+        for idx, (start, goal) in enumerate(pairs):
+            try:
+                _, cost, _ = ara_star(C, start, goal, node_dist, time_budget)
+            except Exception:
+                continue
+            cost_ratios.append(cost / optimal_costs[idx])
+        print(f"Budget = {time_budget * 1e3:.0f} ms: path found for {len(cost_ratios) / len(pairs):.1%}, cost ratio = {np.mean(cost_ratios):.4f}")
@@ -0,0 +1,48 @@
+from astar import *
+from planning_index import load_planning_index
+
+
+def counting_neighbors(C, counter):
+    # neighbors function that counts expansions (one call per expanded node)
+    def neighbors(node):
+        counter[0] += 1
+        return C.neighbors(node)
+    return neighbors
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    N = 200
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    # cross-room queries, where the unidirectional frontier grows the most
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    pairs = places[np.random.randint(0, len(places), size=(4 * N, 2))]
+    pairs = pairs[C.rooms[pairs[:, 0]] != C.rooms[pairs[:, 1]]][:N]
+
+    expansions = np.zeros((len(pairs), 2), dtype=int)
+    times = np.zeros((len(pairs), 2))
+    costs = np.zeros((len(pairs), 2))
+    for idx, (start, goal) in enumerate(pairs.tolist()):
+        counter = [0]
+        t0 = time.perf_counter()
+        _, path_dict, cost_to_come = astar_search(C, start, lambda node: node == goal, heuristic_to(C, node_dist, [goal]), counting_neighbors(C, counter))
+        times[idx, 0] = time.perf_counter() - t0
+        expansions[idx, 0], costs[idx, 0] = counter[0], cost_to_come[goal]
+
+        counter = [0]
+        t0 = time.perf_counter()
+        _, path_dict, cost_to_come = bidirectional_astar_search(C, start, goal, heuristic_to(C, node_dist, [goal]), heuristic_to(C, node_dist, [start]),
+                                                                counting_neighbors(C, counter))
+        times[idx, 1] = time.perf_counter() - t0
+        # the cost of the joined path looks up one neighbor list per path node, not an expansion
+        expansions[idx, 1], costs[idx, 1] = counter[0] - (len(path_dict) - 1), cost_to_come[goal]
+
+    print(f"--- Cross_room results ({len(pairs)}) ---")
+    print(f"Unidirectional: {np.mean(expansions[:, 0]):.1f} expansions, time = {np.mean(times[:, 0]):.5f} sec")
+    print(f"Bidirectional:  {np.mean(expansions[:, 1]):.1f} expansions, time = {np.mean(times[:, 1]):.5f} sec")
+    print(f"Expansions saved = {1 - np.sum(expansions[:, 1]) / np.sum(expansions[:, 0]):.1%}, max cost difference = {np.max(np.abs(costs[:, 0] - costs[:, 1])):.2e}")
@@ -0,0 +1,44 @@
+from astar import *
+from compiled_graph import compile_graph
+
+
+def random_place_pairs(G, N):
+    # random (start, goal) place id values over all places that belong to a room
+    place_values = np.array([value for room in G.get_layer(dsg.DsgLayers.ROOMS).nodes for value in room.children()], dtype=np.uint64)
+    pairs = place_values[np.random.randint(0, len(place_values), size=(N, 2))]
+    return [(int(start), int(goal)) for start, goal in pairs]
+
+
+def queries_per_second(G, planner, pairs):
+    costs = np.zeros(len(pairs))
+    t0 = time.perf_counter()
+    for idx, (start, goal) in enumerate(pairs):
+        if planner == layer_astar:
+            _, costs[idx] = get_info(*planner(G, start, goal, node_dist))
+        else:
+            _, costs[idx] = planner(G, start, goal, node_dist)
+    return len(pairs) / (time.perf_counter() - t0), costs
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    N = 200
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    G = dsg.DynamicSceneGraph.load(str(path_to_dsg))
+
+    t0 = time.perf_counter()
+    C = compile_graph(G)
+    print(f"Compile time: {time.perf_counter() - t0:.5f} sec ({len(C)} nodes, {len(C.indices)} sibling entries)")
+
+    pairs = random_place_pairs(G, N)
+    compiled_pairs = [(C.index_of(start), C.index_of(goal)) for start, goal in pairs]
+    for planner in [layer_astar, hierarchical_planner]:
+        qps_dsg, costs_dsg = queries_per_second(G, planner, pairs)
+        qps_compiled, costs_compiled = queries_per_second(C, planner, compiled_pairs)
+        print(f"--- {planner.__name__} ({N} queries) ---")
+        print(f"DSG:      {qps_dsg:.1f} queries/sec")
+        print(f"Compiled: {qps_compiled:.1f} queries/sec")
+        print(f"Speedup = {qps_compiled / qps_dsg:.2f}x, max cost difference = {np.max(np.abs(costs_dsg - costs_compiled)):.2e}")
+        print()
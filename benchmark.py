@@ -0,0 +1,307 @@
+from astar import *
+from planning_index import load_planning_index
+from portal_graph import build_portal_graph, portal_planner
+from path_cache import PathCache
+from heuristics import build_landmarks
+from batch_planning import k_best_hierarchical_planner, planning_pool
+from contraction_hierarchy import build_contraction_hierarchy
+from bounded_search import SearchArena, bounded_astar
+import argparse
+import tracemalloc
+import warnings
+
+
+IN_ROOM, CROSS_ROOM = 0, 1
+
+# name -> setup(C, heuristic), setup returns query(start, goal, stats) -> (path_list, cost).
+# query.close(), if the setup sets it, releases what the setup allocated (e.g. a process pool)
+# once the planner has run every query.
+PLANNERS = {}
+
+
+def register_planner(name, setup):
+    PLANNERS[name] = setup
+
+
+register_planner("layer_astar", lambda C, heuristic: lambda start, goal, stats=None: get_info(*layer_astar(C, start, goal, heuristic, stats=stats)))
+register_planner("bidirectional_astar", lambda C, heuristic: lambda start, goal, stats=None: get_info(*layer_astar(C, start, goal, heuristic, bidirectional=True, stats=stats)))
+register_planner("dijkstra", lambda C, heuristic: lambda start, goal, stats=None: get_info(*layer_astar(C, start, goal, bad_heuristic, stats=stats)))
+register_planner("hierarchical_planner", lambda C, heuristic: lambda start, goal, stats=None: hierarchical_planner(C, start, goal, heuristic, stats=stats))
+register_planner("hierarchical_corridor", lambda C, heuristic: lambda start, goal, stats=None: hierarchical_planner(C, start, goal, heuristic, corridor=True, stats=stats))
+register_planner("multilevel_planner", lambda C, heuristic: lambda start, goal, stats=None: multilevel_planner(C, start, goal, heuristic, stats=stats))
+register_planner("k_best_hierarchical", lambda C, heuristic: lambda start, goal, stats=None: k_best_hierarchical_planner(C, start, goal, heuristic, stats=stats))
+
+def _setup_cached_hierarchical(C, heuristic):
+    cache = PathCache(C)
+    return lambda start, goal, stats=None: hierarchical_planner(C, start, goal, heuristic, cache=cache, stats=stats)
+register_planner("hierarchical_cached", _setup_cached_hierarchical)
+
+def _setup_portal(C, heuristic):
+    P = build_portal_graph(C)
+    return lambda start, goal, stats=None: portal_planner(P, start, goal, heuristic, stats=stats)
+register_planner("portal_planner", _setup_portal)
+
+def _setup_alt(C, heuristic):
+    alt = build_landmarks(C)
+    return lambda start, goal, stats=None: get_info(*layer_astar(C, start, goal, alt, stats=stats))
+register_planner("alt_astar", _setup_alt)
+
+def _setup_contraction_hierarchy(C, heuristic):
+    ch = build_contraction_hierarchy(C)
+    return lambda start, goal, stats=None: ch(C, start, goal, heuristic, stats=stats)
+register_planner("contraction_hierarchy", _setup_contraction_hierarchy)
+
+def _setup_k_best_pool(C, heuristic):
+    # room paths refined in parallel by a process pool holding C, shut down by query.close()
+    pool = planning_pool(C, heuristic=heuristic)
+    def query(start, goal, stats=None):
+        return k_best_hierarchical_planner(C, start, goal, heuristic, executor=pool, stats=stats)
+    query.close = pool.shutdown
+    return query
+register_planner("k_best_hierarchical_pool", _setup_k_best_pool)
+
+def _setup_bounded(C, heuristic):
+    arena = SearchArena(C)
+    return lambda start, goal, stats=None: bounded_astar(C, start, goal, heuristic, arena, stats=stats)
+register_planner("bounded_astar", _setup_bounded)
+
+
+def _candidate_pool(C, rng, rooms, room_sizes, kind, pool_size):
+    # random (start, goal) place pairs of one kind, about pool_size of them
+    room1 = rng.choice(len(rooms), pool_size, p=room_sizes / room_sizes.sum())
+    room2 = room1 if kind == IN_ROOM else rng.choice(len(rooms), pool_size, p=room_sizes / room_sizes.sum())
+    valid = room1 == room2 if kind == IN_ROOM else room1 != room2
+    pool = []
+    for r1, r2 in zip(room1[valid], room2[valid]):
+        places1, places2 = C.children(rooms[r1]), C.children(rooms[r2])
+        if kind == IN_ROOM:
+            place1, place2 = rng.choice(places1, 2, replace=False)
+        else:
+            place1, place2 = rng.choice(places1), rng.choice(places2)
+        pool.append((place1, place2))
+    return np.array(pool, dtype=np.int64).reshape(-1, 2)
+
+
+def make_query_set(C, num_queries, seed=0, num_bins=4, max_pool_growth=3):
+    # Seeded start/goal places, half in-room and half cross-room, each half split evenly
+    # over num_bins straight-line distance bins (quantiles of a larger candidate pool).
+    # Bins take the remainder one query each. The pool grows (4x, up to max_pool_growth times)
+    # until every bin can be filled, warns if the map still cannot provide num_queries.
+    rng = np.random.default_rng(seed)
+    rooms = [room for room in C.layer_nodes(dsg.DsgLayers.ROOMS).tolist() if len(C.children(room)) >= 2]
+    room_sizes = np.array([len(C.children(room)) for room in rooms], dtype=float)
+
+    starts, goals, kinds, bins = [], [], [], []
+    for kind, target in [(IN_ROOM, num_queries // 2), (CROSS_ROOM, num_queries - num_queries // 2)]:
+        bin_targets = np.array([target // num_bins + (b < target % num_bins) for b in range(num_bins)])
+        pool_size = 8 * num_queries
+        for _ in range(max_pool_growth + 1):
+            pool = _candidate_pool(C, rng, rooms, room_sizes, kind, pool_size) if rooms else np.zeros((0, 2), dtype=np.int64)
+            pool_bins = np.zeros(0, dtype=np.int64)
+            if len(pool):
+                dists = C.node_dists(pool[:, 0], pool[:, 1])
+                edges = np.quantile(dists, np.linspace(0., 1., num_bins + 1))
+                pool_bins = np.clip(np.searchsorted(edges, dists, side="right") - 1, 0, num_bins - 1)
+            if np.all(np.bincount(pool_bins, minlength=num_bins) >= bin_targets):
+                break
+            pool_size *= 4
+        for b in range(num_bins):
+            chosen = pool[pool_bins == b][:bin_targets[b]]
+            starts.extend(chosen[:, 0]); goals.extend(chosen[:, 1])
+            kinds.extend([kind] * len(chosen)); bins.extend([b] * len(chosen))
+
+    if len(starts) < num_queries:
+        warnings.warn(f"Query set has {len(starts)} of {num_queries} queries, the map has too few rooms or places to fill every kind and distance bin")
+    starts, goals = np.array(starts, dtype=np.int64), np.array(goals, dtype=np.int64)
+    return {"start": starts, "goal": goals, "start_id": C.ids[starts], "goal_id": C.ids[goals],
+            "kind": np.array(kinds), "bin": np.array(bins), "seed": np.full(len(starts), seed)}
+
+
+def save_query_set(queries, path):
+    np.savez(path, **queries)
+
+
+def load_query_set(path, C):
+    # node ids are stored too, so a query set stays valid for a recompiled graph
+    data = dict(np.load(path))
+    data["start"] = np.array([C.index_of(value) for value in data["start_id"]], dtype=np.int64)
+    data["goal"] = np.array([C.index_of(value) for value in data["goal_id"]], dtype=np.int64)
+    return data
+
+
+def _solve(query, start, goal, stats=None):
+    # (path_list, cost) of one query, ([], inf) if the planner found no path
+    try:
+        return query(start, goal, stats)
+    except NoPathError:
+        return [], np.inf
+
+
+def _close(query):
+    close = getattr(query, "close", None)
+    if close is not None:
+        close()
+
+
+def run_benchmark(C, planner_names, queries, heuristic=node_dist, warmup=5, repeats=3, reference="dijkstra"):
+    # Runs every planner on every query: the reported time is the best of repeats
+    # (perf_counter_ns), search counters and phase times (PlannerStats) and peak memory
+    # (tracemalloc) come from an extra run, so they do not slow down the timed runs.
+    # Cost ratios are taken against the reference planner, which has to be optimal.
+    # Queries without a path (NoPathError) are kept as failed: cost inf, time and cost ratio nan.
+    starts, goals = queries["start"].tolist(), queries["goal"].tolist()
+    reference_query = PLANNERS[reference](C, heuristic)
+    try:
+        optimal_costs = np.array([_solve(reference_query, start, goal)[1] for start, goal in zip(starts, goals)])
+    finally:
+        _close(reference_query)
+
+    columns = {name: [] for name in ["planner", "query", "kind", "bin", "failed", "time_ns", "setup_ns", "peak_bytes", "cost", "optimal_cost", "cost_ratio", "path_length"]}
+    stats_rows = []
+    for name in planner_names:
+        t0 = time.perf_counter_ns()
+        query = PLANNERS[name](C, heuristic)
+        setup_ns = time.perf_counter_ns() - t0
+        try:
+            for start, goal in list(zip(starts, goals))[:warmup]:
+                _solve(query, start, goal)
+
+            for idx, (start, goal) in enumerate(zip(starts, goals)):
+                times = []
+                for _ in range(repeats):
+                    t0 = time.perf_counter_ns()
+                    path_list, cost = _solve(query, start, goal)
+                    times.append(time.perf_counter_ns() - t0)
+                stats = PlannerStats()
+                _solve(query, start, goal, stats)
+                stats_rows.append(stats.as_dict())
+                tracemalloc.start()
+                _solve(query, start, goal)
+                _, peak_bytes = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                failed = not np.isfinite(cost)
+                columns["planner"].append(name)
+                columns["query"].append(idx)
+                columns["kind"].append(queries["kind"][idx])
+                columns["bin"].append(queries["bin"][idx])
+                columns["failed"].append(failed)
+                columns["time_ns"].append(np.nan if failed else min(times))
+                columns["setup_ns"].append(setup_ns)
+                columns["peak_bytes"].append(peak_bytes)
+                columns["cost"].append(cost)
+                columns["optimal_cost"].append(optimal_costs[idx])
+                columns["cost_ratio"].append(np.nan if failed or not np.isfinite(optimal_costs[idx]) else
+                                             cost / optimal_costs[idx] if optimal_costs[idx] > 0 else 1.)
+                columns["path_length"].append(len(path_list))
+        finally:
+            _close(query)
+    # one column per counter and phase, phases a planner does not have are 0
+    for name in sorted(set().union(*stats_rows), key=lambda name: (name.endswith("_ns"), name)):
+        columns[name] = [row.get(name, 0) for row in stats_rows]
+    return {name: np.array(values) for name, values in columns.items()}
+
+
+def save_results(results, path):
+    # columnar results: .npz keeps one array per column, .csv one row per planner and query
+    path = pathlib.Path(path)
+    if path.suffix == ".csv":
+        names = list(results.keys())
+        with open(path, "w") as f:
+            f.write(",".join(names) + "\n")
+            for row in zip(*(results[name].tolist() for name in names)):
+                f.write(",".join(str(value) for value in row) + "\n")
+    else:
+        np.savez(path, **results)
+
+
+def load_results(path):
+    path = pathlib.Path(path)
+    if path.suffix == ".csv":
+        data = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding=None)
+        return {name: data[name] for name in data.dtype.names}
+    return dict(np.load(path))
+
+
+def summarize(results):
+    # per planner and query kind: median time, mean expansions, peak memory and cost ratio of the
+    # solved queries and the fraction of failed ones
+    summary = {}
+    for name in np.unique(results["planner"]):
+        for kind, kind_name in [(IN_ROOM, "in_room"), (CROSS_ROOM, "cross_room")]:
+            rows = (results["planner"] == name) & (results["kind"] == kind)
+            if not np.any(rows):
+                continue
+            failed = results["failed"][rows] if "failed" in results else np.zeros(np.count_nonzero(rows), dtype=bool)
+            solved = rows.copy()
+            solved[rows] = ~failed
+            summary[(str(name), kind_name)] = {"time_ms": np.median(results["time_ns"][solved]) * 1e-6 if np.any(solved) else np.nan,
+                                               "expansions": np.mean(results["expansions"][rows]),
+                                               "peak_kb": np.mean(results["peak_bytes"][rows]) / 1024,
+                                               "cost_ratio": np.nanmean(results["cost_ratio"][solved]) if np.any(solved) else np.nan,
+                                               "failed": np.mean(failed)}
+    return summary
+
+
+def print_summary(summary):
+    for (name, kind), stats in summary.items():
+        print(f"{name:22s} {kind:10s} time = {stats['time_ms']:.3f} ms, expansions = {stats['expansions']:.1f}, "
+              f"peak = {stats['peak_kb']:.1f} kB, cost ratio = {stats['cost_ratio']:.4f}, failed = {stats['failed']:.1%}")
+
+
+def print_relative(summary, reference):
+    # time and expansions of every planner relative to the reference planner, per query kind
+    for (name, kind), stats in summary.items():
+        if (reference, kind) not in summary or name == reference:
+            continue
+        ref = summary[(reference, kind)]
+        print(f"{name:22s} {kind:10s} vs {reference}: time x{stats['time_ms'] / ref['time_ms']:.3f}, "
+              f"expansions x{stats['expansions'] / max(ref['expansions'], 1e-9):.3f}, cost ratio {stats['cost_ratio']:.4f} vs {ref['cost_ratio']:.4f}")
+
+
+def compare_runs(baseline, candidate, time_tolerance=0.1, cost_tolerance=1e-6):
+    # flags planners/query kinds that got slower than time_tolerance (relative) or worse in cost
+    baseline_summary, candidate_summary = summarize(baseline), summarize(candidate)
+    regressions = []
+    for key, stats in candidate_summary.items():
+        if key not in baseline_summary:
+            continue
+        old = baseline_summary[key]
+        time_change = stats["time_ms"] / old["time_ms"] - 1.
+        cost_change = stats["cost_ratio"] - old["cost_ratio"]
+        flag = time_change > time_tolerance or cost_change > cost_tolerance
+        print(f"{key[0]:22s} {key[1]:10s} time {old['time_ms']:.3f} -> {stats['time_ms']:.3f} ms ({time_change:+.1%}), "
+              f"cost ratio {old['cost_ratio']:.4f} -> {stats['cost_ratio']:.4f}{'  REGRESSION' if flag else ''}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the planners on a seeded, stratified query set")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--dsg", default="./DSGs/uhumans2/backend/dsg.json")
+    run_parser.add_argument("--planners", nargs="+", default=["layer_astar", "hierarchical_planner", "hierarchical_corridor"], choices=sorted(PLANNERS))
+    run_parser.add_argument("--reference", default="hierarchical_planner", help="planner the others are compared with")
+    run_parser.add_argument("--queries", type=int, default=200)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--warmup", type=int, default=5)
+    run_parser.add_argument("--repeats", type=int, default=3)
+    run_parser.add_argument("--out", default="benchmark_results.npz")
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--time-tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        C = load_planning_index(args.dsg)
+        queries = make_query_set(C, args.queries, seed=args.seed)
+        results = run_benchmark(C, args.planners, queries, warmup=args.warmup, repeats=args.repeats)
+        save_results(results, args.out)
+        print_summary(summarize(results))
+        print_relative(summarize(results), args.reference)
+    else:
+        regressions = compare_runs(load_results(args.baseline), load_results(args.candidate), time_tolerance=args.time_tolerance)
+        print(f"{len(regressions)} regression(s)")
@@ -0,0 +1,281 @@
+from astar import *
+from compiled_graph import compile_graph
+from array import array
+import sys
+
+
+# bytes of one frontier entry: the (f, tiebreak, node) tuple, its float and int and the heap slot
+HEAP_ENTRY_BYTES = sys.getsizeof((0., 1 << 20, 1 << 20)) + sys.getsizeof(0.) + sys.getsizeof(1 << 20) + 8
+# bytes of one backed-up node of a shrink on top of its dict slot: int key and float value
+BACKUP_ENTRY_BYTES = sys.getsizeof(1 << 20) + sys.getsizeof(0.)
+
+
+class SearchArena:
+    # Preallocated search state of bounded_astar for one graph: g-values, heuristic values,
+    # parents, backed-up f-values and generation stamps in typed arrays with one slot per node.
+    # A node's g, h and parent are only valid if seen[node] is the generation of the current
+    # query, so a query starts by bumping the generation instead of clearing anything. Reuse
+    # one arena for every query on the graph (one per thread).
+    def __init__(self, G):
+        self.G = G
+        self.C = G if isinstance(G, CompiledGraph) else compile_graph(G)
+        self.generation = 0
+        self.peak_bytes = 0  # peak of the per-query allocations of the last query
+        self._allocate()
+
+    def _allocate(self):
+        n = len(self.C)
+        self.g = array("d", bytes(8 * n))
+        self.h = array("d", bytes(8 * n))
+        self.parents = array("q", bytes(8 * n))
+        self.backed = array("d", bytes(8 * n))  # backed-up f of pending nodes
+        self.seen = array("I", bytes(array("I").itemsize * n))  # generation that set g and parent
+        self.closed = array("I", bytes(array("I").itemsize * n))  # generation that expanded the node, 0 once reopened
+        self.expanded = array("I", bytes(array("I").itemsize * n))  # generation that expanded the node at least once
+        self.pending = array("I", bytes(array("I").itemsize * n))  # generation that closed the node with forgotten children
+        self.generation = 0
+
+    @property
+    def nbytes(self):
+        # preallocated once, shared by every query
+        return sum(len(values) * values.itemsize for values in [self.g, self.h, self.parents, self.backed, self.seen, self.closed, self.expanded, self.pending])
+
+    def next_generation(self):
+        if len(self.g) != len(self.C):  # nodes were added to the graph
+            self._allocate()
+        self.generation += 1
+        if self.generation >= 1 << (8 * self.seen.itemsize):  # wrapped around, clear the stamps once
+            self._allocate()
+            self.generation = 1
+        return self.generation
+
+    def index(self, node):
+        # dense index of a node of G (node, node.id.value for a DSG, index for a CompiledGraph)
+        if isinstance(self.G, CompiledGraph):
+            return self.C.resolve(node)
+        return self.C.resolve(node) if hasattr(node, "id") else self.C.index_of(node)
+
+    def path(self, goal):
+        path_list = [goal]
+        while self.parents[path_list[-1]] >= 0:
+            path_list.append(self.parents[path_list[-1]])
+        path_list.reverse()
+        if isinstance(self.G, CompiledGraph):
+            return path_list
+        return [self.C.node(idx) for idx in path_list]
+
+
+def _backup(node, f, arena, generation, backups):
+    # hands a forgotten subtree's f to the closest ancestor that is not forgotten itself
+    parents, backed, pending = arena.parents, arena.backed, arena.pending
+    while node >= 0 and pending[node] == generation:
+        backed[node] = min(backed[node], f)
+        node = parents[node]
+    if node >= 0 and f < backups.get(node, np.inf):
+        backups[node] = f
+
+
+def _shrink_frontier(heap, max_frontier, arena, generation, sma):
+    # Drops the worse half of the frontier. Dropped nodes are forgotten and regenerated if
+    # needed: with sma, the parent of each forgotten node is reopened with the smallest f
+    # of its forgotten children (SMA* backed-up value), so the frontier stays a lower bound
+    # and the search stays optimal. Reopened nodes that are dropped again are closed and
+    # marked pending (with their backed-up f) until their parent is expanded again.
+    # Without sma (beam), dropped nodes are gone. Returns (frontier, number of entries dropped,
+    # bytes allocated on top of the frontier while shrinking it).
+    heap.sort()
+    keep, rest = heap[:max_frontier // 2], heap[max_frontier // 2:]
+    g, h, parents, backed, seen, closed, expanded, pending = arena.g, arena.h, arena.parents, arena.backed, arena.seen, arena.closed, arena.expanded, arena.pending
+    kept = {node for _, _, node in keep}
+    backups = {}
+    for entry in rest:
+        f, _, node = entry
+        if node in kept or seen[node] != generation or closed[node] == generation:
+            continue  # stale, or the node has a better entry that is kept
+        if expanded[node] == generation:
+            # reopened node, its g-value and closed subtree stay valid
+            if not sma or parents[node] < 0:
+                keep.append(entry)
+                kept.add(node)
+                continue
+            closed[node] = generation
+            backed[node] = min(backed[node], f) if pending[node] == generation else f
+            pending[node] = generation
+            _backup(parents[node], f, arena, generation, backups)
+            continue
+        if f != g[node] + h[node]:
+            continue  # stale, the node has a better entry
+        seen[node] = 0
+        if sma:
+            _backup(parents[node], f, arena, generation, backups)
+    tiebreak = -len(backups)  # backed-up entries go first among equal f, their children are already known
+    for node, f in backups.items():
+        closed[node] = 0
+        if pending[node] == generation:  # dropped again in this pass, reopened after all
+            f = min(f, backed[node])
+            pending[node] = 0
+        keep.append((f, tiebreak, node))
+        tiebreak += 1
+    heapq.heapify(keep)
+    scratch = sys.getsizeof(keep) + sys.getsizeof(rest) + sys.getsizeof(kept) + sys.getsizeof(backups) + len(backups) * (BACKUP_ENTRY_BYTES + HEAP_ENTRY_BYTES)
+    return keep, len(heap) + len(backups) - len(keep), scratch
+
+
+def _truncate_frontier(heap, max_frontier, arena, generation):
+    # Last resort once backed-up parents alone overflow the cap: keeps the best max_frontier
+    # entries and drops the others for good (beam), the search may miss the optimal path.
+    heap.sort()
+    keep, rest = heap[:max_frontier], heap[max_frontier:]
+    seen, closed, expanded = arena.seen, arena.closed, arena.expanded
+    kept = {node for _, _, node in keep}
+    for _, _, node in rest:
+        if node in kept or seen[node] != generation or closed[node] == generation:
+            continue
+        if expanded[node] == generation:
+            closed[node] = generation  # reopened node, its forgotten children stay forgotten
+        else:
+            seen[node] = 0
+    scratch = sys.getsizeof(rest) + sys.getsizeof(kept)
+    return keep, len(rest), scratch
+
+
+def _frontier_bytes(heap):
+    return sys.getsizeof(heap) + len(heap) * (HEAP_ENTRY_BYTES - 8)
+
+
+def bounded_astar(G, start_node, goal_node, heuristic, arena=None, max_frontier=None, fallback="sma", stats=None):
+    # A* whose g-values, heuristic values and parents live in the preallocated arrays of a
+    # SearchArena instead of per-query dicts, returns (path_list, cost). The heuristic is
+    # evaluated once per generated node. max_frontier: hard cap on the number of
+    # frontier entries (HEAP_ENTRY_BYTES each), checked after every expansion, once exceeded
+    # the worse half is dropped:
+    # fallback="sma" keeps the search optimal by reopening parents (SMA*), "beam" drops the
+    # entries for good, which is cheaper but can miss the optimal path or any path. If the
+    # reopened parents alone do not fit in a very small cap, SMA* drops the worst of them
+    # for good as well and is no longer guaranteed to be optimal, the frontier never
+    # exceeds the cap.
+    # arena.peak_bytes (and stats.frontier_bytes) is the peak of everything the query allocates
+    # on top of the arena: the frontier, the scratch lists of a shrink and the path.
+    if fallback not in ["sma", "beam"]:
+        raise Exception(f"Unknown fallback {fallback}")
+    arena = SearchArena(G) if arena is None else arena
+    C = arena.C
+    start, goal = arena.index(start_node), arena.index(goal_node)
+    generation = arena.next_generation()
+    g, h, parents, backed, seen, closed, expanded, pending = arena.g, arena.h, arena.parents, arena.backed, arena.seen, arena.closed, arena.expanded, arena.pending
+    max_expansions = 16 * len(C)
+    heuristic = bind_heuristic(C, heuristic)
+
+    with phase(stats, "search"):
+        g[start] = 0.
+        h[start] = heuristic(start, goal)
+        parents[start] = -1
+        seen[start] = generation
+        heap = [(h[start], 0, start)]
+        tiebreak = 1
+        expansions = pops = pruned = 0
+        peak = 0
+        reached = False
+        while heap:
+            _, _, node = heapq.heappop(heap)
+            pops += 1
+            if seen[node] != generation or closed[node] == generation:
+                continue
+            if node == goal:
+                reached = True
+                break
+            closed[node] = expanded[node] = generation
+            expansions += 1
+            node_cost = g[node]
+            for neighbor, edge_cost in C.neighbors(node):
+                if closed[neighbor] == generation:
+                    if pending[neighbor] == generation and parents[neighbor] == node:
+                        # forgotten children of the neighbor, reopen it with its backed-up f
+                        closed[neighbor] = pending[neighbor] = 0
+                        heapq.heappush(heap, (backed[neighbor], tiebreak, neighbor))
+                        tiebreak += 1
+                    continue
+                cost = node_cost + edge_cost
+                if seen[neighbor] != generation:
+                    h[neighbor] = heuristic(neighbor, goal)
+                    seen[neighbor] = generation
+                elif cost >= g[neighbor]:
+                    continue
+                g[neighbor] = cost
+                parents[neighbor] = node
+                heapq.heappush(heap, (cost + h[neighbor], tiebreak, neighbor))
+                tiebreak += 1
+            frontier_bytes = _frontier_bytes(heap)
+            if max_frontier is not None and len(heap) > max_frontier:
+                heap, dropped, scratch = _shrink_frontier(heap, max_frontier, arena, generation, fallback == "sma")
+                pruned += dropped
+                # the backed-up parents can overflow the cap again, shrink until they are
+                # collapsed into their ancestors, if that stops helping drop them for good
+                while len(heap) > max_frontier:
+                    size = len(heap)
+                    heap, dropped, more = _shrink_frontier(heap, max_frontier, arena, generation, fallback == "sma")
+                    pruned += dropped
+                    scratch = max(scratch, more)
+                    if len(heap) >= size:
+                        heap, dropped, more = _truncate_frontier(heap, max_frontier, arena, generation)
+                        pruned += dropped
+                        scratch = max(scratch, more)
+                frontier_bytes += scratch
+            if frontier_bytes > peak:
+                peak = frontier_bytes
+            if expansions > max_expansions:  # regenerating the same nodes over and over
+                break
+
+    if reached:
+        path_list = arena.path(goal)
+        peak = max(peak, _frontier_bytes(heap) + sys.getsizeof(path_list))
+    arena.peak_bytes = peak
+    if stats is not None:
+        stats.add_search(expansions, tiebreak, pops)
+        stats.pruned += pruned
+        stats.frontier_bytes = max(stats.frontier_bytes, arena.peak_bytes)
+    if not reached:
+        raise NoPathError("Goal node not reachable from start node" if pruned == 0 else "No path found within the memory cap")
+    return path_list, g[goal]
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    import tracemalloc
+    np.random.seed(0)
+    N = 200
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+    arena = SearchArena(C)
+    print(f"Search arena: {arena.nbytes / 1e3:.1f} kB for {len(C)} nodes, allocated once")
+
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    pairs = places[np.random.randint(0, len(places), size=(N, 2))].tolist()
+    optimal_costs = np.array([get_info(*layer_astar(C, start, goal, node_dist))[1] for start, goal in pairs])
+    frontier = 64
+    planners = [("layer_astar", lambda start, goal: get_info(*layer_astar(C, start, goal, node_dist))),
+                ("bounded_astar", lambda start, goal: bounded_astar(C, start, goal, node_dist, arena)),
+                (f"bounded_astar, SMA* cap {frontier}", lambda start, goal: bounded_astar(C, start, goal, node_dist, arena, frontier)),
+                (f"bounded_astar, beam cap {frontier}", lambda start, goal: bounded_astar(C, start, goal, node_dist, arena, frontier, "beam"))]
+    for name, planner in planners:
+        times, peaks, reported, ratios = [], [], [], []
+        for idx, (start, goal) in enumerate(pairs):
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            try:
+                _, cost = planner(start, goal)
+            except Exception:
+                cost = np.inf
+            times.append(time.perf_counter() - t0)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            reported.append(arena.peak_bytes)
+            ratios.append(cost / optimal_costs[idx] if optimal_costs[idx] > 0 else 1.)
+        ratios = np.array(ratios)
+        # tracemalloc misses objects reused from the interpreter's free lists, peak_bytes does not
+        peak_bytes = f", arena.peak_bytes = {np.mean(reported) / 1e3:.1f} kB (max {np.max(reported) / 1e3:.1f} kB)" if name.startswith("bounded") else ""
+        print(f"{name}: {np.mean(times):.5f} sec, peak memory = {np.mean(peaks) / 1e3:.1f} kB (max {np.max(peaks) / 1e3:.1f} kB){peak_bytes}, "
+              f"path found for {np.mean(np.isfinite(ratios)):.1%}, cost ratio = {np.mean(ratios[np.isfinite(ratios)]):.4f}")
@@ -1,70 +1,42 @@
 from astar import *
+from benchmark import make_query_set, run_benchmark, save_results, IN_ROOM, CROSS_ROOM
+from planning_index import load_planning_index
 import pickle
 import matplotlib.pyplot as plt
 
 
-def save_data(N):
+def save_data(N, seed=0, repeats=1):
+    # layer A* vs. hierarchical planner on a seeded query set from the benchmark harness,
+    # the same seed always gives the same queries
     path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
     path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
 
-    G = dsg.DynamicSceneGraph.load(str(path_to_dsg))
-    room_layer = G.get_layer(dsg.DsgLayers.ROOMS)
-    room_nodes = list(room_layer.nodes)
-    num_rooms = len(room_nodes)
-    room_sizes = np.zeros(num_rooms, dtype=int)
-    for idx in range(num_rooms):
-        room_sizes[idx] = len(room_nodes[idx].children())
-
-    in_room_place_layer = {'times':[], 'costs':[]}
-    in_room_hierarchical = {'times':[], 'costs':[]}
-    cross_room_place_layer = {'times':[], 'costs':[]}
-    cross_room_hierarchical = {'times':[], 'costs':[]}
-
-    # randomly select rooms and nodes from rooms to plan paths between them
-    # record resluts in different dicts to distinguish between in_room and cross_room planned paths
-    room_indices = np.random.choice(np.arange(num_rooms), (N, 2))
+    C = load_planning_index(path_to_dsg)
+    queries = make_query_set(C, N, seed=seed)
 
     t0 = time.time()
-    for idx in range(N):
-        room_idx1, room_idx2 = room_indices[idx]
-        if room_idx1 == room_idx2:
-            node_idx1, node_idx2 = np.random.choice(np.arange(room_sizes[room_idx1]), 2, replace=False)
-        else:
-            node_idx1 = np.random.choice(np.arange(room_sizes[room_idx1]))
-            node_idx2 = np.random.choice(np.arange(room_sizes[room_idx2]))
-        place1 = G.get_node(list(room_nodes[room_idx1].children())[node_idx1])
-        place2 = G.get_node(list(room_nodes[room_idx2].children())[node_idx2])
-        t1 = time.time()
-        _, layer_cost = get_info(*layer_astar(G, place1, place2, node_dist))
-        t2 = time.time()
-        _, hier_cost = hierarchical_planner(G, place1, place2, node_dist)
-        t3 = time.time()
-        if room_idx1 == room_idx2:
-            in_room_place_layer['times'].append(t2 - t1)
-            in_room_place_layer['costs'].append(layer_cost)
-            in_room_hierarchical['times'].append(t3 - t2)
-            in_room_hierarchical['costs'].append(hier_cost)
-        else:
-            cross_room_place_layer['times'].append(t2 - t1)
-            cross_room_place_layer['costs'].append(layer_cost)
-            cross_room_hierarchical['times'].append(t3 - t2)
-            cross_room_hierarchical['costs'].append(hier_cost)
-
+    results = run_benchmark(C, ["layer_astar", "hierarchical_planner"], queries, repeats=repeats)
+    save_results(results, "benchmark_results.npz")
     tf = time.time()
     print(f"Total compute time: {tf - t0}")
 
-    data = {"in_room_place_layer": in_room_place_layer, 
-            "in_room_hierarchical": in_room_hierarchical, 
-            "cross_room_place_layer": cross_room_place_layer, 
-            "cross_room_hierarchical": cross_room_hierarchical}
+    # record results in different dicts to distinguish between in_room and cross_room planned paths
+    data = {}
+    for kind, kind_name in [(IN_ROOM, "in_room"), (CROSS_ROOM, "cross_room")]:
+        for planner, planner_name in [("layer_astar", "place_layer"), ("hierarchical_planner", "hierarchical")]:
+            rows = (results["planner"] == planner) & (results["kind"] == kind)
+            data[f"{kind_name}_{planner_name}"] = {'times': (results["time_ns"][rows] * 1e-9).tolist(),
+                                                   'costs': results["cost"][rows].tolist(),
+                                                   'expansions': results["expansions"][rows].tolist(),
+                                                   # PlannerStats phase times, room_level and segments for the hierarchical planner
+                                                   'phases': {name[:-3]: (results[name][rows] * 1e-9).tolist() for name in results if name.endswith("_ns") and name not in ["time_ns", "setup_ns"]}}
     with open("result_dicts.pkl", "wb") as outfile:
         pickle.dump(data, outfile)
 
 
 if __name__ == "__main__":
-    np.random.seed(0) # not working???
     N = 1000
-    # save_data(N) # comment out if re-compute not needed, takes a while
+    # save_data(N, seed=0) # comment out if re-compute not needed, takes a while
 
     with open("result_dicts.pkl", "rb") as f:
         data = pickle.load(f)
@@ -145,3 +117,15 @@ if __name__ == "__main__":
     # ax.legend()
     # ax.set_title("Hierarchical Planner Compute Efficiency wrt. True Shortest Path Length")
     fig.savefig("plots/times.png")
+
+    if "phases" in cross_room_hierarchical:
+        # where the hierarchical planner spends its time: room level search vs. room segments
+        fig, ax = plt.subplots(figsize=(8, 8))
+        for label, data_dict, optimal_costs in [("in room", in_room_hierarchical, optimal_costs_in), ("cross room", cross_room_hierarchical, optimal_costs_cross)]:
+            room_level = np.array(data_dict['phases']['room_level'])
+            segments = np.array(data_dict['phases']['segments'])
+            ax.scatter(optimal_costs, room_level / (room_level + segments), marker='.', alpha=alpha, label=label)
+        ax.set_xlabel("Optimal path length [m]")
+        ax.set_ylabel("Room level share of planning time [-]")
+        ax.legend()
+        fig.savefig("plots/hierarchical_phases.png")
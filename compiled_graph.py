@@ -0,0 +1,281 @@
+import spark_dsg as dsg
+import numpy as np
+import math
+import copy
+import hashlib
+import itertools
+
+
+# graph versions are drawn from one counter, so a version identifies one state of one graph
+# (costed views included) and version-keyed caches never mistake one graph for another
+_VERSIONS = itertools.count(1)
+
+
+class CompiledGraph:
+    # Array-backed snapshot of a DSG. Nodes are addressed by dense int indices:
+    # ids[i] is the node.id.value of node i, positions[i] its position, and the
+    # siblings of node i are indices[indptr[i]:indptr[i + 1]] with edge lengths
+    # lengths[indptr[i]:indptr[i + 1]] (2D, same as node_dist).
+    # mapped: the arrays are memory-mapped (planning_index.py) and shared between processes,
+    # the search loops then read them directly instead of private python copies.
+    def __init__(self, ids, layers, positions, indptr, indices, lengths, parents, names=None, bbox_min=None, bbox_max=None, radii=None, weights=None, G=None, mapped=False):
+        self.ids = np.asarray(ids, dtype=np.uint64)
+        self.layers = np.asarray(layers, dtype=np.int64)
+        self.positions = np.asarray(positions, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=float)
+        self.weights = np.ones(len(self.indices)) if weights is None else np.asarray(weights, dtype=float)  # edge.info.weight of every edge
+        self.parents = np.asarray(parents, dtype=np.int64)  # -1 if no parent
+        self.names = np.asarray([""] * len(self.ids) if names is None else names, dtype=str)  # object names, "" otherwise
+        # room bounding boxes (from add_bounding_boxes_to_layer), nan for every other node
+        self.bbox_min = np.full((len(self.ids), 3), np.nan) if bbox_min is None else np.asarray(bbox_min, dtype=float)
+        self.bbox_max = np.full((len(self.ids), 3), np.nan) if bbox_max is None else np.asarray(bbox_max, dtype=float)
+        # free-space radius of places (distance to the closest obstacle), nan for every other node
+        self.radii = np.full(len(self.ids), np.nan) if radii is None else np.asarray(radii, dtype=float)
+        self.G = G  # source DSG, only needed to go back to node objects
+        self.mapped = mapped
+        self.version = next(_VERSIONS)  # renewed on every change to the graph, invalidates caches
+        self.edits = []  # (idx1, idx2) of every changed edge, in order
+        self._overrides = {}  # node -> adjacency list replacing its CSR row after edits
+        self._fingerprint = None  # (version, fingerprint()) of the last call
+        self._build_derived()
+
+    def _build_derived(self):
+        n = len(self.ids)
+        # ids sorted once for node.id.value -> index lookups (searchsorted)
+        self._id_order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._id_order]
+        # children CSR, inverse of parents
+        has_parent = np.flatnonzero(self.parents >= 0)
+        order = has_parent[np.argsort(self.parents[has_parent], kind="stable")]
+        counts = np.bincount(self.parents[has_parent], minlength=n)
+        self.child_indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.child_indices = order.astype(np.int64)
+        # room index of every node (the node itself for rooms, -1 above the room layer)
+        self.rooms = self.ancestors_in_layer(dsg.DsgLayers.ROOMS)
+        self._ancestors = {}  # layer -> ancestors_in_layer(layer) as a list, filled by ancestors()
+        # object name -> places the instances of that object are attached to
+        self.object_places = {}
+        for obj in np.flatnonzero((self.layers == dsg.DsgLayers.OBJECTS) & (self.parents >= 0)).tolist():
+            if self.layers[self.parents[obj]] == dsg.DsgLayers.PLACES:
+                self.object_places.setdefault(str(self.names[obj]), set()).add(int(self.parents[obj]))
+        self.object_places = {name: sorted(places) for name, places in self.object_places.items()}
+        # python-side views for the scalar search loops, not for mapped arrays (every process
+        # would hold a private copy of the graph)
+        if self.mapped:
+            self._xy = self._indptr = self._indices = self._lengths = None
+        else:
+            self._xy = self.positions[:, :2].tolist()
+            self._indptr = self.indptr.tolist()
+            self._indices = self.indices.tolist()
+            self._lengths = self.lengths.tolist()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # the spark_dsg graph does not pickle, worker processes get the arrays only
+        indptr, indices, lengths = self.csr()
+        return {"ids": self.ids, "layers": self.layers, "positions": self.positions,
+                "indptr": indptr, "indices": indices, "lengths": lengths,
+                "parents": self.parents, "names": self.names, "bbox_min": self.bbox_min, "bbox_max": self.bbox_max, "radii": self.radii, "weights": self.edge_weights()}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def ancestors_in_layer(self, layer):
+        # index of the ancestor of every node that lies in layer (-1 if none)
+        result = np.where(self.layers == layer, np.arange(len(self)), -1)
+        curr = self.parents.copy()
+        while np.any(curr >= 0):
+            valid = curr >= 0
+            hit = valid & (result < 0) & (self.layers[np.maximum(curr, 0)] == layer)
+            result[hit] = curr[hit]
+            curr[valid] = self.parents[curr[valid]]
+        return result
+
+    def resolve(self, node):
+        # node object or dense index -> dense index
+        if hasattr(node, "id"):
+            return self.index_of(node.id.value)
+        return int(node)
+
+    def index_of(self, value):
+        # node.id.value -> dense index
+        value = np.uint64(value)
+        pos = int(np.searchsorted(self._sorted_ids, value))
+        if pos == len(self._sorted_ids) or self._sorted_ids[pos] != value:
+            raise KeyError(int(value))
+        return int(self._id_order[pos])
+
+    def node(self, idx):
+        # dense index -> spark_dsg node (needs the source graph)
+        if self.G is None:
+            raise Exception("Compiled graph has no source DSG attached")
+        return self.G.get_node(int(self.ids[idx]))
+
+    def ancestors(self, layer):
+        # cached ancestors_in_layer(layer) as a python list, for lookups in the search loops
+        if layer not in self._ancestors:
+            self._ancestors[layer] = self.ancestors_in_layer(layer).tolist()
+        return self._ancestors[layer]
+
+    def layer_nodes(self, layer):
+        return np.flatnonzero(self.layers == layer)
+
+    def neighbors(self, idx):
+        if idx in self._overrides:
+            return self._overrides[idx]
+        if self._indptr is None:
+            start, end = int(self.indptr[idx]), int(self.indptr[idx + 1])
+            return zip(self.indices[start:end].tolist(), self.lengths[start:end].tolist())
+        start, end = self._indptr[idx], self._indptr[idx + 1]
+        return zip(self._indices[start:end], self._lengths[start:end])
+
+    def csr(self):
+        # CSR arrays with all edits applied
+        if not self._overrides:
+            return self.indptr, self.indices, self.lengths
+        rows = [list(self.neighbors(idx)) for idx in range(len(self))]
+        indptr = np.concatenate(([0], np.cumsum([len(row) for row in rows]))).astype(np.int64)
+        indices = np.array([neighbor for row in rows for neighbor, _ in row], dtype=np.int64)
+        lengths = np.array([edge_cost for row in rows for _, edge_cost in row], dtype=float)
+        return indptr, indices, lengths
+
+    def edge_weights(self):
+        # edge.info.weight of every edge of csr(), edges inserted by set_edge weigh 1
+        if not self._overrides:
+            return self.weights
+        sources = np.repeat(np.arange(len(self)), np.diff(self.indptr)).tolist()
+        original = dict(zip(zip(sources, self.indices.tolist()), self.weights.tolist()))
+        return np.array([original.get((idx, neighbor), 1.) for idx in range(len(self)) for neighbor, _ in self.neighbors(idx)], dtype=float)
+
+    def fingerprint(self):
+        # sha256 of the node ids and the edges with their costs (edits applied), identifies the
+        # graph precomputed structures were built on, across processes and files
+        if self._fingerprint is None or self._fingerprint[0] != self.version:
+            digest = hashlib.sha256()
+            for values in (self.ids, *self.csr()):
+                digest.update(np.ascontiguousarray(values).tobytes())
+            self._fingerprint = (self.version, digest.hexdigest())
+        return self._fingerprint[1]
+
+    def with_costs(self, costs):
+        # graph with the same nodes and edges whose edge costs are costs (aligned with csr()),
+        # the planners run on it unchanged. Shares the node arrays, edits do not carry over. The
+        # view has its own version and fingerprint(), caches and guards never take it for self.
+        indptr, indices, _ = self.csr()
+        view = copy.copy(self)
+        view.weights = self.edge_weights()
+        view.indptr, view.indices, view.lengths = indptr, indices, np.asarray(costs, dtype=float)
+        view._indptr, view._indices, view._lengths = indptr.tolist(), indices.tolist(), view.lengths.tolist()
+        view.mapped = False  # the costs are private to this process
+        view._overrides = {}
+        view._fingerprint = None
+        view.edits = []
+        view.version = next(_VERSIONS)
+        return view
+
+    def _edit_row(self, idx):
+        if idx not in self._overrides:
+            self._overrides[idx] = list(self.neighbors(idx))
+        return self._overrides[idx]
+
+    def set_edge(self, idx1, idx2, cost=None):
+        # insert the sibling edge idx1 - idx2 or change its cost (default: 2D length)
+        cost = self.node_dist(idx1, idx2) if cost is None else float(cost)
+        for source, target in [(idx1, idx2), (idx2, idx1)]:
+            row = self._edit_row(source)
+            row[:] = [(neighbor, edge_cost) for neighbor, edge_cost in row if neighbor != target]
+            row.append((target, cost))
+        self.edits.append((idx1, idx2))
+        self.version = next(_VERSIONS)
+
+    def remove_edge(self, idx1, idx2):
+        for source, target in [(idx1, idx2), (idx2, idx1)]:
+            row = self._edit_row(source)
+            row[:] = [(neighbor, edge_cost) for neighbor, edge_cost in row if neighbor != target]
+        self.edits.append((idx1, idx2))
+        self.version = next(_VERSIONS)
+
+    def edge_cost(self, idx1, idx2):
+        for neighbor, edge_cost in self.neighbors(idx1):
+            if neighbor == idx2:
+                return edge_cost
+        return None
+
+    def add_node(self, value, layer, position, parent=-1, name=""):
+        # appends a node without edges and returns its index, use set_edge to connect it
+        idx = len(self)
+        self.ids = np.append(self.ids, np.uint64(value))
+        self.layers = np.append(self.layers, layer)
+        self.positions = np.vstack((self.positions, np.asarray(position, dtype=float).reshape(1, 3)))
+        self.indptr = np.append(self.indptr, self.indptr[-1])
+        self.parents = np.append(self.parents, parent)
+        self.names = np.append(self.names, name)
+        self.bbox_min = np.vstack((self.bbox_min, np.full((1, 3), np.nan)))
+        self.bbox_max = np.vstack((self.bbox_max, np.full((1, 3), np.nan)))
+        self.radii = np.append(self.radii, np.nan)
+        self._build_derived()
+        self.version = next(_VERSIONS)
+        return idx
+
+    def remove_node(self, idx):
+        # drops every sibling edge of idx, the index itself stays valid
+        for neighbor, _ in list(self.neighbors(idx)):
+            self.remove_edge(idx, neighbor)
+
+    def children(self, idx):
+        return self.child_indices[self.child_indptr[idx]:self.child_indptr[idx + 1]]
+
+    def node_dist(self, idx1, idx2):
+        if self._xy is None:
+            p1, p2 = self.positions[idx1], self.positions[idx2]
+            return math.hypot(float(p1[0] - p2[0]), float(p1[1] - p2[1]))
+        p1, p2 = self._xy[idx1], self._xy[idx2]
+        return math.hypot(p1[0] - p2[0], p1[1] - p2[1])
+
+    def node_dists(self, nodes, goal):
+        # node_dist of every node in nodes to goal
+        diff = self.positions[nodes, :2] - self.positions[goal, :2]
+        return np.hypot(diff[..., 0], diff[..., 1])
+
+
+def compile_graph(G):
+    # one pass over the bindings, everything afterwards is array lookups
+    nodes = list(G.nodes)
+    index = {node.id.value: i for i, node in enumerate(nodes)}
+    ids = np.array([node.id.value for node in nodes], dtype=np.uint64)
+    layers = np.array([node.layer for node in nodes], dtype=np.int64)
+    positions = np.array([node.attributes.position for node in nodes], dtype=float).reshape(-1, 3)
+    names = [getattr(node.attributes, "name", "") if node.layer == dsg.DsgLayers.OBJECTS else "" for node in nodes]
+    bbox_min = np.full((len(nodes), 3), np.nan)
+    bbox_max = np.full((len(nodes), 3), np.nan)
+    for i, node in enumerate(nodes):
+        if node.layer == dsg.DsgLayers.ROOMS and hasattr(node.attributes, "bounding_box"):
+            bbox_min[i] = node.attributes.bounding_box.min
+            bbox_max[i] = node.attributes.bounding_box.max
+    radii = np.array([getattr(node.attributes, "distance", np.nan) if node.layer == dsg.DsgLayers.PLACES else np.nan for node in nodes], dtype=float)
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indices = []
+    parents = np.full(len(nodes), -1, dtype=np.int64)
+    for i, node in enumerate(nodes):
+        siblings = sorted(index[value] for value in node.siblings() if value in index)
+        indices.extend(siblings)
+        indptr[i + 1] = len(indices)
+        parent = node.get_parent()
+        if parent is not None and parent in index:
+            parents[i] = index[parent]
+    indices = np.array(indices, dtype=np.int64)
+    sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+    lengths = np.linalg.norm(positions[sources, :2] - positions[indices, :2], ord=2, axis=1)
+    edge_weights = {}
+    for layer in G.layers:
+        for edge in layer.edges:
+            if edge.source in index and edge.target in index:
+                weight = float(getattr(edge.info, "weight", 1.))
+                edge_weights[(index[edge.source], index[edge.target])] = edge_weights[(index[edge.target], index[edge.source])] = weight
+    weights = np.array([edge_weights.get(edge, 1.) for edge in zip(sources.tolist(), indices.tolist())], dtype=float)
+    return CompiledGraph(ids, layers, positions, indptr, indices, lengths, parents, names=names, bbox_min=bbox_min, bbox_max=bbox_max, radii=radii, weights=weights, G=G)
@@ -0,0 +1,296 @@
+from astar import *
+from compiled_graph import compile_graph
+
+
+class ContractionHierarchy:
+    # Contraction hierarchy over the place layer of a static map. Places are contracted one
+    # by one (fewest added shortcuts first), every contraction adds shortcut edges between
+    # its remaining neighbors unless a witness path is as short. A query is a bidirectional
+    # Dijkstra that only goes up in rank (with stall-on-demand), which settles a few dozen
+    # nodes instead of a region of the map, shortcuts are unpacked into place paths afterwards. Exact for the
+    # graph it was built on, it has to be rebuilt once edges or their costs change: queries on
+    # any other graph (edited, costed view, other map) raise, see CompiledGraph.fingerprint.
+    # Can be passed as method wherever layer_astar is: ch(G, start, goal, heuristic) -> (path_list, cost),
+    # the heuristic is not used.
+    def __init__(self, ids, ranks, indptr, indices, costs, middles, fingerprint):
+        self.ids = np.asarray(ids, dtype=np.uint64)  # node.id.value of every place, in hierarchy order
+        self.ranks = np.asarray(ranks, dtype=np.int64)  # contraction order of every place
+        # upward graph CSR: edges from every place to neighbors of higher rank, middles[e] is
+        # the place a shortcut skips (-1 for edges of the place layer)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.costs = np.asarray(costs, dtype=float)
+        self.middles = np.asarray(middles, dtype=np.int64)
+        self.fingerprint = str(fingerprint)  # fingerprint() of the compiled graph it was built from
+        self._index = {int(value): i for i, value in enumerate(self.ids)}
+        # python-side views for the scalar query loop
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._costs = self.costs.tolist()
+        sources = np.repeat(np.arange(len(self.ids)), np.diff(self.indptr)).tolist()
+        self._middles = {(source, target): middle for source, target, middle in zip(sources, self._indices, self.middles.tolist())}
+        self._bound = None  # (compiled graph, its version, columns, nodes) of the last query
+        self._checked = None  # DSG whose compiled graph matched the fingerprint
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # arrays only, the python-side views and the graph bound by _columns_for are rebuilt
+        return {"ids": self.ids, "ranks": self.ranks, "indptr": self.indptr, "indices": self.indices,
+                "costs": self.costs, "middles": self.middles, "fingerprint": self.fingerprint}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def num_shortcuts(self):
+        return int(np.sum(self.middles >= 0))
+
+    def _columns_for(self, C):
+        # hierarchy node of every node of C (-1 if not in the hierarchy) and the inverse
+        if self._bound is not None and self._bound[0] is C and self._bound[1] == C.version:
+            return self._bound[2], self._bound[3]
+        self._check(C)
+        order = np.argsort(self.ids)
+        positions = np.minimum(np.searchsorted(self.ids[order], C.ids), max(len(self) - 1, 0))
+        columns = np.where(self.ids[order][positions] == C.ids, order[positions], -1) if len(self) else np.full(len(C), -1)
+        nodes = np.full(len(self), -1, dtype=np.int64)
+        nodes[columns[columns >= 0]] = np.flatnonzero(columns >= 0)
+        self._bound = (C, C.version, columns.tolist(), nodes.tolist())
+        return self._bound[2], self._bound[3]
+
+    def _check(self, C):
+        if C.fingerprint() != self.fingerprint:
+            raise Exception("Graph differs from the one the contraction hierarchy was built on (edited, other costs or another map)")
+
+    def _search(self, source, target):
+        # (cost, meeting node, forward parents, backward parents, settled, pushes, pops)
+        dists = ({source: 0.}, {target: 0.})
+        parents = ({source: -1}, {target: -1})
+        heaps = ([(0., source)], [(0., target)])
+        best, meeting = np.inf, -1
+        settled = pushes = pops = 0
+        side = 0
+        while heaps[0] or heaps[1]:
+            if not heaps[side]:
+                side = 1 - side
+            dist, node = heapq.heappop(heaps[side])
+            pops += 1
+            if dist > dists[side][node]:
+                continue
+            if dist >= best:
+                # every node left on this side is farther than the best meeting point
+                heaps[side].clear()
+                continue
+            settled += 1
+            other = dists[1 - side].get(node)
+            if other is not None and dist + other < best:
+                best, meeting = dist + other, node
+            side_dists, side_parents, heap = dists[side], parents[side], heaps[side]
+            edges = range(self._indptr[node], self._indptr[node + 1])
+            # stall-on-demand: a higher ranked neighbor reaches node cheaper, so no shortest
+            # path goes up through node on this side
+            if any(side_dists.get(self._indices[edge], np.inf) + self._costs[edge] < dist for edge in edges):
+                side = 1 - side
+                continue
+            for edge in edges:
+                neighbor = self._indices[edge]
+                new_dist = dist + self._costs[edge]
+                if new_dist < side_dists.get(neighbor, np.inf):
+                    side_dists[neighbor] = new_dist
+                    side_parents[neighbor] = node
+                    heapq.heappush(heap, (new_dist, neighbor))
+                    pushes += 1
+            side = 1 - side
+        return best, meeting, parents[0], parents[1], settled, pushes, pops
+
+    def _unpack(self, first, second):
+        # hierarchy nodes of the place path of edge (first, second), first included
+        path = []
+        stack = [(first, second)]
+        while stack:
+            u, v = stack.pop()
+            middle = self._middles.get((u, v), self._middles.get((v, u), -1))
+            if middle < 0:
+                path.append(u)
+            else:
+                stack.append((middle, v))
+                stack.append((u, middle))
+        return path
+
+    def query(self, source, target, stats=None):
+        # (place path, cost) between two hierarchy nodes, raises if there is no path
+        with phase(stats, "search"):
+            cost, meeting, forward, backward, settled, pushes, pops = self._search(source, target)
+        if stats is not None:
+            stats.add_search(settled, pushes + 2, pops)
+        if meeting < 0:
+            raise NoPathError("Goal node not reachable from start node")
+        with phase(stats, "unpack"):
+            up = [meeting]
+            while forward[up[-1]] >= 0:
+                up.append(forward[up[-1]])
+            up.reverse()
+            while backward[up[-1]] >= 0:
+                up.append(backward[up[-1]])
+            path = []
+            for first, second in zip(up[:-1], up[1:]):
+                path.extend(self._unpack(first, second))
+            path.append(up[-1])
+        return path, cost
+
+    def __call__(self, G, start_node, goal_node, heuristic=None, stats=None):
+        if isinstance(G, CompiledGraph):
+            columns, nodes = self._columns_for(G)
+            source, target = columns[G.resolve(start_node)], columns[G.resolve(goal_node)]
+        else:
+            if self._checked is not G:
+                self._check(compile_graph(G))
+                self._checked = G
+            start_node, goal_node = as_node(G, start_node, stats), as_node(G, goal_node, stats)
+            source, target = self._index.get(start_node.id.value, -1), self._index.get(goal_node.id.value, -1)
+        if source < 0 or target < 0:
+            raise Exception("Start or goal node is not in the contraction hierarchy")
+        path, cost = self.query(source, target, stats)
+        if isinstance(G, CompiledGraph):
+            return [nodes[node] for node in path], cost
+        return [as_node(G, int(self.ids[node]), stats) for node in path], cost
+
+
+def _witness_costs(adjacency, source, skipped, max_cost, max_settled):
+    # Dijkstra from source in the remaining graph without skipped, up to max_cost or
+    # max_settled nodes. Upper bounds of the distances, exact for the nodes it settled.
+    dists = {source: 0.}
+    heap = [(0., source)]
+    settled = 0
+    while heap and settled < max_settled:
+        dist, node = heapq.heappop(heap)
+        if dist > dists[node]:
+            continue
+        if dist > max_cost:
+            break
+        settled += 1
+        for neighbor, edge_cost in adjacency[node].items():
+            if neighbor == skipped:
+                continue
+            new_dist = dist + edge_cost
+            if new_dist < dists.get(neighbor, np.inf):
+                dists[neighbor] = new_dist
+                heapq.heappush(heap, (new_dist, neighbor))
+    return dists
+
+
+def _shortcuts(adjacency, node, max_settled):
+    # shortcuts (u, w, cost) needed to contract node: pairs of neighbors whose only
+    # shortest connection goes through node
+    neighbors = list(adjacency[node].items())
+    shortcuts = []
+    for i, (u, cost_u) in enumerate(neighbors[:-1]):
+        targets = [(w, cost_u + cost_w) for w, cost_w in neighbors[i + 1:]]
+        witnesses = _witness_costs(adjacency, u, node, max(cost for _, cost in targets), max_settled)
+        shortcuts.extend((u, w, cost) for w, cost in targets if witnesses.get(w, np.inf) > cost)
+    return shortcuts
+
+
+def build_contraction_hierarchy(G, max_settled=64):
+    # Offline contraction of the place layer. Nodes are ordered by edge difference (shortcuts
+    # added - edges removed) plus the number of contracted neighbors, which spreads the
+    # contraction evenly over the map, priorities are updated lazily when a node is popped.
+    # max_settled bounds every witness search: a missed witness only adds a superfluous
+    # shortcut, queries stay exact.
+    C = G if isinstance(G, CompiledGraph) else compile_graph(G)
+    places = C.layer_nodes(dsg.DsgLayers.PLACES).tolist()
+    local = {place: i for i, place in enumerate(places)}
+    adjacency = [{} for _ in places]  # remaining graph, neighbor -> cost
+    middles = {}  # (u, w) with u < w -> middle of the cheapest shortcut between them
+    for place in places:
+        for neighbor, edge_cost in C.neighbors(place):
+            if neighbor in local:
+                u, w = local[place], local[neighbor]
+                adjacency[u][w] = min(edge_cost, adjacency[u].get(w, np.inf))
+    contracted_neighbors = [0] * len(places)
+
+    def priority(node):
+        return len(_shortcuts(adjacency, node, max_settled)) - len(adjacency[node]) + contracted_neighbors[node]
+
+    heap = [(priority(node), node) for node in range(len(places))]
+    heapq.heapify(heap)
+    ranks = np.zeros(len(places), dtype=np.int64)
+    upward = []  # (node, higher ranked neighbor, cost, middle)
+    rank = 0
+    while heap:
+        _, node = heapq.heappop(heap)
+        # lazy update: contract only if the node still has the lowest priority
+        new_priority = priority(node)
+        if heap and new_priority > heap[0][0]:
+            heapq.heappush(heap, (new_priority, node))
+            continue
+        ranks[node] = rank
+        rank += 1
+        for neighbor, edge_cost in adjacency[node].items():
+            upward.append((node, neighbor, edge_cost, middles.get((min(node, neighbor), max(node, neighbor)), -1)))
+        for u, w, cost in _shortcuts(adjacency, node, max_settled):
+            if cost < adjacency[u].get(w, np.inf):
+                adjacency[u][w] = adjacency[w][u] = cost
+                middles[(min(u, w), max(u, w))] = node
+        for neighbor in adjacency[node]:
+            del adjacency[neighbor][node]
+            contracted_neighbors[neighbor] += 1
+        adjacency[node] = {}
+
+    upward.sort()
+    sources = np.array([edge[0] for edge in upward], dtype=np.int64)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=len(places))))).astype(np.int64)
+    return ContractionHierarchy(C.ids[places], ranks, indptr, [edge[1] for edge in upward], [edge[2] for edge in upward],
+                                [edge[3] for edge in upward], C.fingerprint())
+
+
+def contraction_hierarchy_path(path_to_dsg):
+    # the hierarchy is stored next to dsg.json
+    return pathlib.Path(path_to_dsg).expanduser().absolute().parent / "contraction_hierarchy.npz"
+
+
+def save_contraction_hierarchy(ch, path):
+    np.savez(path, ids=ch.ids, ranks=ch.ranks, indptr=ch.indptr, indices=ch.indices, costs=ch.costs, middles=ch.middles, fingerprint=ch.fingerprint)
+
+
+def load_contraction_hierarchy(path):
+    data = np.load(path)
+    if "fingerprint" not in data.files:
+        raise Exception("Contraction hierarchy was saved without a graph fingerprint, rebuild it")
+    return ContractionHierarchy(data["ids"], data["ranks"], data["indptr"], data["indices"], data["costs"], data["middles"], data["fingerprint"])
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    from astar_object import nav_to_object
+    np.random.seed(0)
+    N = 1000
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    t0 = time.perf_counter()
+    ch = build_contraction_hierarchy(C)
+    save_contraction_hierarchy(ch, contraction_hierarchy_path(path_to_dsg))
+    print(f"Contraction: {time.perf_counter() - t0:.3f} sec, {ch.num_shortcuts()} shortcuts, saved to {contraction_hierarchy_path(path_to_dsg)}")
+    ch = load_contraction_hierarchy(contraction_hierarchy_path(path_to_dsg))
+
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    pairs = places[np.random.randint(0, len(places), size=(N, 2))].tolist()
+    for name, method in [("layer_astar", lambda start, goal: get_info(*layer_astar(C, start, goal, node_dist))),
+                         ("contraction_hierarchy", lambda start, goal: ch(C, start, goal, node_dist))]:
+        costs = np.zeros(N)
+        t0 = time.perf_counter()
+        for idx, (start, goal) in enumerate(pairs):
+            _, costs[idx] = method(start, goal)
+        elapsed = time.perf_counter() - t0
+        print(f"{name}: {elapsed / N * 1e6:.1f} us/query, mean cost = {np.mean(costs):.3f}")
+
+    if C.object_places:
+        target_object = sorted(C.object_places)[0]
+        t0 = time.perf_counter()
+        _, cost = nav_to_object(C, pairs[0][0], target_object, ch, node_dist)
+        print(f"nav_to_object({target_object}) with the contraction hierarchy: cost = {cost:.3f}, {time.perf_counter() - t0:.5f} sec")
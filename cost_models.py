@@ -0,0 +1,108 @@
+from astar import *
+from compiled_graph import compile_graph
+from heuristics import EuclideanHeuristic
+import weakref
+
+
+class CostModel:
+    # Edge cost profile, a weighted sum of per-edge terms:
+    #   length * edge length (2D, the cost of every planner so far)
+    # + weight * edge.info.weight
+    # + clearance * edge length * (1 - r / safe_distance), r the smaller free-space radius of the
+    #   two places (0 once r >= safe_distance, edges without radii get none)
+    # + edge length * mean room penalty of the two nodes, room_penalties: room node.id.value -> cost per meter
+    # compile(C) evaluates it once for every edge into a graph with the same nodes whose edge
+    # costs are the model's, every planner runs on that graph with its usual inner loop.
+    # All terms are >= 0, so heuristic (length times node_dist) stays admissible.
+    def __init__(self, length=1., weight=0., clearance=0., safe_distance=1., room_penalties=None):
+        if min(length, weight, clearance) < 0. or any(penalty < 0. for penalty in (room_penalties or {}).values()):
+            raise Exception("Cost model terms have to be nonnegative")
+        self.length = length
+        self.weight = weight
+        self.clearance = clearance
+        self.safe_distance = safe_distance
+        self.room_penalties = dict(room_penalties or {})
+        self.heuristic = EuclideanHeuristic(length)
+        self._compiled = weakref.WeakKeyDictionary()  # source graph -> (its version, compiled graph)
+
+    def __getstate__(self):
+        # compiled graphs stay with the process that compiled them
+        state = self.__dict__.copy()
+        del state["_compiled"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compiled = weakref.WeakKeyDictionary()
+
+    def edge_costs(self, C):
+        # cost of every edge of C.csr() under this model
+        indptr, indices, lengths = C.csr()
+        sources = np.repeat(np.arange(len(C)), np.diff(indptr))
+        costs = self.length * lengths
+        if self.weight:
+            costs = costs + self.weight * C.edge_weights()
+        if self.clearance:
+            radii = np.nan_to_num(np.fmin(C.radii[sources], C.radii[indices]), nan=np.inf)
+            costs = costs + self.clearance * lengths * np.clip(1. - radii / self.safe_distance, 0., 1.)
+        if self.room_penalties:
+            penalties = np.zeros(len(C))
+            for room_value, penalty in self.room_penalties.items():
+                penalties[C.index_of(room_value)] = penalty
+            node_penalties = np.where(C.rooms >= 0, penalties[C.rooms], 0.)
+            costs = costs + lengths * (node_penalties[sources] + node_penalties[indices]) / 2.
+        return costs
+
+    def compile(self, G):
+        # graph of G with this model's edge costs, kept per graph until it changes or is dropped
+        C = G if isinstance(G, CompiledGraph) else compile_graph(G)
+        compiled = self._compiled.get(C)
+        if compiled is None or compiled[0] != C.version:
+            compiled = self._compiled[C] = (C.version, C.with_costs(self.edge_costs(C)))
+        return compiled[1]
+
+
+# named profiles, CostModel(room_penalties=...) for map specific ones
+COST_MODELS = {
+    "shortest": CostModel(),
+    "weighted": CostModel(weight=1.),
+    "clearance": CostModel(clearance=2., safe_distance=1.),
+}
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    np.random.seed(0)
+    N = 200
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    pairs = places[np.random.randint(0, len(places), size=(N, 2))].tolist()
+    # the room most queries go through is busy
+    rooms = C.layer_nodes(dsg.DsgLayers.ROOMS)
+    busy_room = int(C.ids[rooms[np.argmax(np.bincount(C.rooms[places], minlength=len(C))[rooms])]])
+    models = dict(COST_MODELS, busy_room=CostModel(room_penalties={busy_room: 5.}))
+
+    # the same cost as a callback per edge, what a cost function in the search loop would do
+    def callback_neighbors(model):
+        return lambda node: [(neighbor, model.length * edge_cost) for neighbor, edge_cost in C.neighbors(node)]
+
+    t0 = time.perf_counter()
+    for start, goal in pairs:
+        astar_search(C, start, lambda node: node == goal, heuristic_to(C, node_dist, [goal]), callback_neighbors(models["shortest"]))
+    print(f"Per-edge callback: {(time.perf_counter() - t0) / N:.5f} sec/query")
+    for name, model in models.items():
+        t0 = time.perf_counter()
+        compiled = model.compile(C)
+        compile_time = time.perf_counter() - t0
+        costs, lengths = np.zeros(N), np.zeros(N)
+        t0 = time.perf_counter()
+        for idx, (start, goal) in enumerate(pairs):
+            path_list, costs[idx] = get_info(*layer_astar(compiled, start, goal, model.heuristic))
+            lengths[idx] = sum(C.node_dist(node1, node2) for node1, node2 in zip(path_list[:-1], path_list[1:]))
+        print(f"{name}: compile = {compile_time:.5f} sec, {(time.perf_counter() - t0) / N:.5f} sec/query, "
+              f"mean cost = {np.mean(costs):.3f}, mean length = {np.mean(lengths):.3f}")
@@ -0,0 +1,163 @@
+from astar import *
+from compiled_graph import compile_graph
+from collections import OrderedDict
+
+
+_SOURCE = -1  # virtual node connected to every source with zero cost
+
+
+class DistanceField:
+    # Dijkstra distances of one search over the sibling edges of a CompiledGraph, as arrays
+    # over all nodes: from a start place (cost to come), or with reverse=True from a set of
+    # goal places (cost to the closest goal, the graph is undirected). Costs and paths to
+    # any number of places, rooms or object classes are array lookups afterwards.
+    def __init__(self, C, sources, reverse=False, stats=None):
+        self.C = C
+        self.version = C.version
+        self.sources = sorted({C.resolve(source) for source in np.atleast_1d(sources).tolist()})
+        self.reverse = reverse
+        self.dists = np.full(len(C), np.inf)
+        self.parents = np.full(len(C), -1, dtype=np.int64)  # toward the source, -1 for sources and unreached nodes
+        def neighbors(node):
+            return [(source, 0.) for source in self.sources] if node == _SOURCE else C.neighbors(node)
+        with phase(stats, "search"):
+            _, path_dict, cost_to_come = astar_search(C, _SOURCE, lambda node: False, lambda node: 0., neighbors, stats)
+        del path_dict[_SOURCE], cost_to_come[_SOURCE]
+        nodes = np.fromiter(cost_to_come.keys(), dtype=np.int64, count=len(cost_to_come))
+        self.dists[nodes] = np.fromiter(cost_to_come.values(), dtype=float, count=len(cost_to_come))
+        self.parents[nodes] = np.fromiter(path_dict.values(), dtype=np.int64, count=len(path_dict))
+        self.parents[self.sources] = -1
+
+    def is_current(self):
+        return self.version == self.C.version
+
+    def costs(self, nodes):
+        # cost of every node in nodes, inf if unreachable
+        return self.dists[np.asarray(nodes, dtype=np.int64)]
+
+    def path(self, node):
+        # path_list from the start to node, or from node to its closest goal for a reverse field
+        node = self.C.resolve(node)
+        if not np.isfinite(self.dists[node]):
+            raise NoPathError("Node not reachable from the field sources")
+        path_list = [node]
+        while self.parents[path_list[-1]] >= 0:
+            path_list.append(int(self.parents[path_list[-1]]))
+        return path_list if self.reverse else path_list[::-1]
+
+    def _closest(self, groups, places, keys):
+        # closest place of each group in keys and its cost, places[i] belongs to groups[i]
+        order = np.lexsort((self.dists[places], groups))
+        firsts = np.flatnonzero(np.r_[True, groups[order][1:] != groups[order][:-1]])
+        best_place = dict(zip(groups[order][firsts].tolist(), places[order][firsts].tolist()))
+        closest = np.array([best_place.get(key, -1) for key in keys], dtype=np.int64)
+        return np.where(closest >= 0, self.dists[closest], np.inf), closest
+
+    def room_costs(self, rooms=None):
+        # (costs, closest places) of the rooms, every room of C by default, like
+        # naive_place_to_room_astar for each of them. Places are -1 for unreachable rooms.
+        places = self.C.layer_nodes(dsg.DsgLayers.PLACES)
+        places = places[self.C.rooms[places] >= 0]
+        rooms = self.C.layer_nodes(dsg.DsgLayers.ROOMS) if rooms is None else np.asarray(rooms, dtype=np.int64)
+        return self._closest(self.C.rooms[places], places, rooms.tolist())
+
+    def object_costs(self, names=None):
+        # (costs, closest places) of the object classes, every class of C by default, like
+        # nav_to_object for each of them
+        object_places = self.C.object_places
+        names = sorted(object_places) if names is None else list(names)
+        groups = np.array([i for i, name in enumerate(object_places) for _ in object_places[name]], dtype=np.int64)
+        places = np.array([place for name in object_places for place in object_places[name]], dtype=np.int64)
+        name_index = {name: i for i, name in enumerate(object_places)}
+        return self._closest(groups, places, [name_index.get(name, -1) for name in names])
+
+
+class FieldCache:
+    # Distance fields of a compiled graph that are reused while the graph does not change:
+    # the forward field of the current robot place (recomputed once the robot moves) and an
+    # LRU cache of reverse fields of goal sets (object classes, rooms, ...).
+    def __init__(self, G, maxsize=64):
+        self.C = G if isinstance(G, CompiledGraph) else compile_graph(G)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._start_field = None
+        self._goal_fields = OrderedDict()  # sorted goal places -> reverse DistanceField
+
+    def from_start(self, start_node, stats=None):
+        start_node = self.C.resolve(start_node)
+        field = self._start_field
+        if field is not None and field.is_current() and field.sources == [start_node]:
+            self.hits += 1
+            return field
+        self.misses += 1
+        self._start_field = DistanceField(self.C, start_node, stats=stats)
+        return self._start_field
+
+    def to_goals(self, goal_nodes, stats=None):
+        key = tuple(sorted({self.C.resolve(goal) for goal in np.atleast_1d(goal_nodes).tolist()}))
+        field = self._goal_fields.get(key)
+        if field is not None and field.is_current():
+            self.hits += 1
+            self._goal_fields.move_to_end(key)
+            return field
+        self.misses += 1
+        field = DistanceField(self.C, list(key), reverse=True, stats=stats)
+        self._goal_fields[key] = field
+        self._goal_fields.move_to_end(key)
+        if len(self._goal_fields) > self.maxsize:
+            self._goal_fields.popitem(last=False)
+        return field
+
+    def to_object(self, object_name, stats=None):
+        places = self.C.object_places.get(object_name, [])
+        if len(places) == 0:
+            raise Exception("No place found that corresponds to the desired object")
+        return self.to_goals(places, stats)
+
+    def to_room(self, room, stats=None):
+        places = [place for place in self.C.children(self.C.resolve(room)).tolist() if self.C.layers[place] == dsg.DsgLayers.PLACES]
+        if len(places) == 0:
+            raise Exception("Room has no places")
+        return self.to_goals(places, stats)
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    from astar_object import nav_to_object
+    np.random.seed(0)
+    N = 20
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+    rooms = C.layer_nodes(dsg.DsgLayers.ROOMS)
+    names = sorted(C.object_places)
+
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    starts = np.random.choice(places[C.rooms[places] >= 0], N).tolist()
+
+    # every object class and every room from the same robot place
+    t0 = time.perf_counter()
+    for start in starts:
+        for name in names:
+            nav_to_object(C, start, name, layer_astar, node_dist)
+        for room in rooms.tolist():
+            try:
+                naive_place_to_room_astar(C, start, room, node_dist)
+            except Exception:
+                pass
+    search_time = (time.perf_counter() - t0) / N
+    cache = FieldCache(C)
+    t0 = time.perf_counter()
+    for start in starts:
+        field = cache.from_start(start)
+        object_costs, _ = field.object_costs(names)
+        room_costs, _ = field.room_costs(rooms)
+    field_time = (time.perf_counter() - t0) / N
+    print(f"--- {len(names)} object classes + {len(rooms)} rooms per robot place ({N}) ---")
+    print(f"One search per target: {search_time:.5f} sec")
+    print(f"One distance field: {field_time:.5f} sec ({search_time / field_time:.1f}x)")
+    t0 = time.perf_counter()
+    cache.from_start(starts[-1]).object_costs(names)
+    print(f"Robot did not move (cached field): {time.perf_counter() - t0:.6f} sec")
@@ -0,0 +1,194 @@
+from astar import *
+from astar_object import build_object_index, nav_to_object
+from collections import OrderedDict
+import re
+import query_llm
+
+
+_MISSING = object()  # cache miss marker, None is a valid cached answer
+
+
+class LRUCache:
+    # dict with a maximum size, the least recently used entry is dropped first
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+
+class StubModel:
+    # Offline stand-in for a transformers text-generation pipeline: same call signature and
+    # output format, answers with an object named in the question or matching a keyword.
+    # latency and per_prompt (sec) simulate the cost of a forward pass and of every prompt in it.
+    def __init__(self, keywords=None, latency=0., per_prompt=0.):
+        self.keywords = {} if keywords is None else keywords  # object name -> words that point to it
+        self.latency = latency
+        self.per_prompt = per_prompt
+        self.calls = 0
+
+    def _answer(self, prompt):
+        question, _, options = prompt.partition("Please choose from the following options: ")
+        objects = [name.strip() for name in options.split(". ")[0].split(",") if name.strip()]
+        words = set(re.findall(r"[a-z]+", question.lower()))
+        for name in objects:
+            if name in words or words & set(self.keywords.get(name, [])):
+                return name
+        return objects[0] if objects else ""
+
+    def __call__(self, prompts, **kwargs):
+        self.calls += 1
+        single = isinstance(prompts, str)
+        prompts = [prompts] if single else list(prompts)
+        time.sleep(self.latency + self.per_prompt * len(prompts))
+        responses = [[{"generated_text": prompt + " " + self._answer(prompt)}] for prompt in prompts]
+        return responses[0] if single else responses
+
+
+def normalize_prompt(question):
+    # questions that only differ in case, spacing or trailing punctuation share a cache entry
+    return " ".join(question.lower().split()).strip(" ?!.")
+
+
+class GoalResolver:
+    # Turns a natural language request into an object of the scene and a path to it:
+    # prompt -> object name (language model, LRU cached by normalized prompt) -> candidate
+    # places of that object (LRU cached) -> nav_to_object. The model is loaded once, on the
+    # first prompt that misses the cache, unless a model (e.g. StubModel) is given.
+    def __init__(self, G, objects=None, model=None, model_name='mistralai/Mistral-7B-v0.1', maxsize=1024, batch_size=8):
+        self.G = G
+        self.model = model
+        self.model_name = model_name
+        self.batch_size = batch_size
+        if objects is None:
+            if isinstance(G, CompiledGraph):
+                objects = sorted(G.object_places)
+            else:
+                objects = sorted({obj.attributes.name for obj in G.get_layer(dsg.DsgLayers.OBJECTS).nodes})
+        self.objects = list(objects)
+        self.object_cache = LRUCache(maxsize)  # normalized prompt -> object name
+        self.place_cache = LRUCache(maxsize)  # object name -> candidate places
+        self._object_index = None  # build_object_index(G), built on the first place_cache miss
+
+    def build_prompt(self, question):
+        options_prompt = "Please choose from the following options: " + ", ".join(self.objects) + ". Please only type the name of the object."
+        return question + " " + options_prompt
+
+    def parse_object(self, prompt, generated_text):
+        # first object name in the generated continuation of the prompt, None if there is none
+        answer = generated_text[len(prompt):] if generated_text.startswith(prompt) else generated_text
+        answer = answer.lower()
+        matches = [(match.start(), name) for name in self.objects for match in [re.search(r"\b" + re.escape(name.lower()) + r"\b", answer)] if match]
+        return min(matches)[1] if matches else None
+
+    def _generate(self, prompts):
+        if self.model is None:
+            return query_llm.query_model_batch(prompts, self.model_name, self.batch_size)
+        responses = self.model(prompts, truncation=True, max_length=50, num_return_sequences=1, batch_size=self.batch_size)
+        return [response[0]['generated_text'] for response in responses]
+
+    def resolve_objects(self, questions):
+        # object name (None if the model did not name one) of every question, the questions
+        # missing from the cache go to the model in batches of batch_size. The normalized
+        # question is only the cache key, the model gets the question as it was asked.
+        keys = [normalize_prompt(question) for question in questions]
+        cached = [self.object_cache.get(key, _MISSING) for key in keys]
+        missing = OrderedDict()  # key -> first question with that key
+        for key, question, object_name in zip(keys, questions, cached):
+            if object_name is _MISSING:
+                missing.setdefault(key, question)
+        missing = list(missing.items())
+        resolved = {}
+        for start in range(0, len(missing), self.batch_size):
+            batch = [key for key, _ in missing[start:start + self.batch_size]]
+            prompts = [self.build_prompt(question) for _, question in missing[start:start + self.batch_size]]
+            for key, prompt, generated_text in zip(batch, prompts, self._generate(prompts)):
+                resolved[key] = self.parse_object(prompt, generated_text)
+                self.object_cache.put(key, resolved[key])
+        return [resolved[key] if object_name is _MISSING else object_name for key, object_name in zip(keys, cached)]
+
+    def resolve_object(self, question):
+        return self.resolve_objects([question])[0]
+
+    def candidate_places(self, object_name):
+        # places that instances of object_name are attached to (build_object_index)
+        places = self.place_cache.get(object_name)
+        if places is None:
+            if self._object_index is None:
+                self._object_index = build_object_index(self.G)
+            places = self._object_index.get(object_name, [])
+            self.place_cache.put(object_name, places)
+        return places
+
+    def plan(self, start_node, question, method=layer_astar, heuristic=node_dist):
+        # (object name, path_list, cost) of the path from start_node to the requested object
+        object_name = self.resolve_object(question)
+        if object_name is None:
+            raise Exception("Model did not choose any of the objects")
+        path_list, cost = nav_to_object(self.G, start_node, object_name, method, heuristic,
+                                        object_index={object_name: self.candidate_places(object_name)})
+        return object_name, path_list, cost
+
+    def stats(self):
+        return {"objects": self.object_cache.stats(), "places": self.place_cache.stats()}
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    np.random.seed(0)
+    N = 200
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    # offline model, pass model=None to query the language model instead
+    keywords = {"couch": ["sit", "comfortably", "rest"], "laptop": ["work", "email"], "trashcan": ["throw", "garbage"],
+                "plant": ["water"], "painting": ["art", "look"]}
+    model = StubModel(keywords, latency=0.05, per_prompt=0.01)
+    questions = ["I want to sit comfortably, where shall I go?", "Where can I throw away this garbage?", "I need to check my email.",
+                 "The plant needs water.", "I'd like to look at some art.", "Where is the chair?"]
+    requests = [questions[i] for i in np.random.randint(0, len(questions), N)]
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    starts = np.random.choice(places[C.rooms[places] >= 0], N).tolist()
+
+    for name, batch_size in [("One prompt per forward pass", 1), ("Batched prompts", 8)]:
+        resolver = GoalResolver(C, model=model, batch_size=batch_size)
+        model.calls = 0
+        t0 = time.perf_counter()
+        resolver.resolve_objects(requests[:len(questions) * 4] + [question.upper() for question in questions])
+        print(f"{name}: {model.calls} model calls, {time.perf_counter() - t0:.3f} sec")
+
+    # end to end, prompt -> object -> path
+    resolver = GoalResolver(C, model=model)
+    times = np.zeros(N)
+    for idx, (start, question) in enumerate(zip(starts, requests)):
+        t0 = time.perf_counter()
+        try:
+            resolver.plan(start, question)
+        except Exception:  # object not in the scene or not reachable
+            pass
+        times[idx] = time.perf_counter() - t0
+    print(f"Prompt -> path: first query = {times[0]:.5f} sec, cached queries = {np.mean(times[1:]):.5f} +- {np.std(times[1:]):.5f} sec")
+    print(resolver.stats())
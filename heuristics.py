@@ -0,0 +1,144 @@
+from astar import *
+from compiled_graph import compile_graph
+
+
+# Heuristics have a scalar form on dense indices, bind(C), which the searches call lazily for
+# every node they generate (heuristic_to), and a vectorized form, batch(C, nodes, goal), which
+# heuristic_to only uses for the min over several goals (multi_goal_astar, nav_to_object).
+
+
+class EuclideanHeuristic:
+    # node_dist with a vectorized form: batch(C, nodes, goal) gives the 2D distance of
+    # every node in nodes to goal in one call. scale: factor on the distance, admissible
+    # for edge costs of at least scale times the edge length (see cost_models.CostModel)
+    def __init__(self, scale=1.):
+        self.scale = scale
+
+    def __call__(self, node1, node2):
+        return self.scale * node_dist(node1, node2)
+
+    def bind(self, C):
+        if self.scale == 1.:
+            return C.node_dist
+        return lambda idx1, idx2: self.scale * C.node_dist(idx1, idx2)
+
+    def batch(self, C, nodes, goal):
+        return self.scale * C.node_dists(nodes, goal)
+
+
+class LandmarkHeuristic:
+    # ALT heuristic: with exact distances d(l, .) from a few landmarks l, the triangle
+    # inequality gives |d(l, goal) - d(l, node)| <= d(node, goal) for every landmark.
+    # Takes the max over landmarks and the Euclidean bound. Stays admissible as long as
+    # edge costs only go up after the tables were built (blocked or slower edges).
+    def __init__(self, ids, landmarks, tables):
+        self.ids = np.asarray(ids, dtype=np.uint64)  # node.id.value of every table column
+        self.landmarks = np.asarray(landmarks, dtype=np.uint64)  # node.id.value of every landmark
+        self.tables = np.asarray(tables, dtype=float)  # (num_landmarks, num_nodes), inf if unreachable
+        self._index = {int(value): i for i, value in enumerate(self.ids)}
+        self._euclidean = EuclideanHeuristic()
+        self._bound = None
+
+    def _tables_for(self, C):
+        # table columns in the node order of C
+        if self._bound is not None and self._bound[0] is C:
+            return self._bound[1]
+        if np.array_equal(self.ids, C.ids):
+            tables = self.tables
+        else:
+            columns = np.array([self._index.get(int(value), -1) for value in C.ids])
+            tables = np.where(columns >= 0, self.tables[:, np.maximum(columns, 0)], np.inf)
+        self._bound = (C, tables, None)
+        return tables
+
+    def _columns_for(self, C):
+        # table columns of C as python lists for the scalar heuristic, built once per graph
+        tables = self._tables_for(C)
+        if self._bound[2] is None:
+            self._bound = (C, tables, tables.T.tolist())
+        return self._bound[2]
+
+    def _bound_of(self, dists_node, dists_goal):
+        with np.errstate(invalid="ignore"):
+            bounds = np.abs(dists_goal - dists_node)
+        # inf - inf: neither node is reachable from the landmark, no information
+        return np.max(np.nan_to_num(bounds, nan=0.), axis=0, initial=0.)
+
+    def __call__(self, node1, node2):
+        cols = [self._index[node1.id.value], self._index[node2.id.value]]
+        return max(node_dist(node1, node2), float(self._bound_of(self.tables[:, cols[0]], self.tables[:, cols[1]])))
+
+    def bind(self, C):
+        columns = self._columns_for(C)
+        def heuristic(idx1, idx2):
+            bound = max((abs(d2 - d1) for d1, d2 in zip(columns[idx1], columns[idx2]) if d1 != d2), default=0.)
+            return max(bound, C.node_dist(idx1, idx2))
+        return heuristic
+
+    def batch(self, C, nodes, goal):
+        tables = self._tables_for(C)
+        return np.maximum(self._bound_of(tables[:, nodes], tables[:, [goal]]), self._euclidean.batch(C, nodes, goal))
+
+
+def landmark_tables(C, landmarks):
+    # exact distances from every landmark to every node (Dijkstra over sibling edges)
+    tables = np.full((len(landmarks), len(C)), np.inf)
+    for row, landmark in enumerate(landmarks):
+        _, _, cost_to_come = astar_search(C, landmark, lambda node: False, lambda node: 0.)
+        tables[row, list(cost_to_come.keys())] = list(cost_to_come.values())
+    return tables
+
+
+def build_landmarks(G, num_landmarks=8, layer=dsg.DsgLayers.PLACES):
+    # farthest-point landmark selection on the given layer, each new landmark is the node
+    # farthest (in graph distance) from all landmarks picked so far
+    C = G if isinstance(G, CompiledGraph) else compile_graph(G)
+    nodes = C.layer_nodes(layer)
+    landmarks = [int(nodes[np.argmax(np.linalg.norm(C.positions[nodes] - C.positions[nodes].mean(axis=0), axis=1))])]
+    tables = landmark_tables(C, landmarks)
+    while len(landmarks) < min(num_landmarks, len(nodes)):
+        min_dists = np.min(tables[:, nodes], axis=0)
+        min_dists[~np.isfinite(min_dists)] = -1.  # unreachable from every landmark
+        landmarks.append(int(nodes[np.argmax(min_dists)]))
+        tables = np.vstack((tables, landmark_tables(C, landmarks[-1:])))
+    return LandmarkHeuristic(C.ids, C.ids[landmarks], tables)
+
+
+def landmarks_path(path_to_dsg):
+    # landmark tables are stored next to dsg.json
+    return pathlib.Path(path_to_dsg).expanduser().absolute().parent / "landmarks.npz"
+
+
+def save_landmarks(heuristic, path):
+    np.savez(path, ids=heuristic.ids, landmarks=heuristic.landmarks, tables=heuristic.tables)
+
+
+def load_landmarks(path):
+    data = np.load(path)
+    return LandmarkHeuristic(data["ids"], data["landmarks"], data["tables"])
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    np.random.seed(0)
+    N = 200
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    t0 = time.perf_counter()
+    alt = build_landmarks(C, num_landmarks=8)
+    save_landmarks(alt, landmarks_path(path_to_dsg))
+    print(f"Landmark precomputation: {time.perf_counter() - t0:.5f} sec, saved to {landmarks_path(path_to_dsg)}")
+    alt = load_landmarks(landmarks_path(path_to_dsg))
+
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    pairs = places[np.random.randint(0, len(places), size=(N, 2))].tolist()
+    for name, heuristic in [("node_dist", node_dist), ("EuclideanHeuristic", EuclideanHeuristic()), ("LandmarkHeuristic", alt)]:
+        costs = np.zeros(N)
+        t0 = time.perf_counter()
+        for idx, (start, goal) in enumerate(pairs):
+            _, costs[idx] = get_info(*layer_astar(C, start, goal, heuristic))
+        print(f"{name}: {N / (time.perf_counter() - t0):.1f} queries/sec, mean cost = {np.mean(costs):.3f}")
@@ -0,0 +1,161 @@
+from astar import *
+from planning_index import load_planning_index
+import heapq
+
+
+MIN_EDGE_COST = 1e-9  # places stacked in z have zero 2D edge length, D* Lite needs positive costs
+
+
+class DStarLite:
+    # Incremental planner (D* Lite) on a CompiledGraph. The search runs from the goal
+    # towards the start and keeps its g/rhs values between calls to plan(), so edits
+    # of the graph (C.set_edge, C.remove_edge, C.add_node, C.remove_node) and moves of
+    # the start only repair the part of the search they affect.
+    def __init__(self, C, start_node, goal_node, heuristic):
+        self.C = C
+        self.start = C.resolve(start_node)
+        self.goal = C.resolve(goal_node)
+        if C.layers[self.start] != C.layers[self.goal]:
+            raise Exception("Start and goal not on the same layer")
+        self.heuristic = bind_heuristic(C, heuristic)
+        self.g = {}
+        self.rhs = {self.goal: 0.}
+        self.km = 0.
+        self.last = self.start
+        self.Q = []  # heap of (k1, k2, tiebreak, node)
+        self.queued = {}  # node -> key of its live heap entry
+        self.tiebreak = 0
+        self.edit_pos = len(C.edits)  # edits before this point are already part of the search
+        self.expansions = 0
+        self._push(self.goal)
+
+    def _neighbors(self, node):
+        return [(neighbor, max(edge_cost, MIN_EDGE_COST)) for neighbor, edge_cost in self.C.neighbors(node)]
+
+    def _key(self, node):
+        cost = min(self.g.get(node, np.inf), self.rhs.get(node, np.inf))
+        return (cost + self.heuristic(self.start, node) + self.km, cost)
+
+    def _push(self, node):
+        key = self._key(node)
+        self.queued[node] = key
+        heapq.heappush(self.Q, (key[0], key[1], self.tiebreak, node))
+        self.tiebreak += 1
+
+    def _top_key(self):
+        # drop stale entries (lazy deletion) and peek the smallest live key
+        while self.Q:
+            k1, k2, _, node = self.Q[0]
+            if self.queued.get(node) == (k1, k2):
+                return (k1, k2)
+            heapq.heappop(self.Q)
+        return (np.inf, np.inf)
+
+    def _update_vertex(self, node):
+        if node != self.goal:
+            self.rhs[node] = min((edge_cost + self.g.get(neighbor, np.inf) for neighbor, edge_cost in self._neighbors(node)), default=np.inf)
+        self.queued.pop(node, None)
+        if self.g.get(node, np.inf) != self.rhs.get(node, np.inf):
+            self._push(node)
+
+    def _compute_shortest_path(self):
+        while self._top_key() < self._key(self.start) or self.rhs.get(self.start, np.inf) != self.g.get(self.start, np.inf):
+            k1, k2, _, node = heapq.heappop(self.Q)
+            del self.queued[node]
+            self.expansions += 1
+            new_key = self._key(node)
+            if (k1, k2) < new_key:
+                self._push(node)
+            elif self.g.get(node, np.inf) > self.rhs.get(node, np.inf):
+                self.g[node] = self.rhs[node]
+                for neighbor, _ in self.C.neighbors(node):
+                    self._update_vertex(neighbor)
+            else:
+                self.g[node] = np.inf
+                self._update_vertex(node)
+                for neighbor, _ in self.C.neighbors(node):
+                    self._update_vertex(neighbor)
+
+    def move_start(self, start_node):
+        # the robot moved, the key modifier keeps the queued keys valid
+        start_node = self.C.resolve(start_node)
+        self.km += self.heuristic(self.last, start_node)
+        self.last = start_node
+        self.start = start_node
+
+    def plan(self):
+        # applies the edits made since the last call and returns (path_list, cost)
+        for node1, node2 in self.C.edits[self.edit_pos:]:
+            self._update_vertex(node1)
+            self._update_vertex(node2)
+        self.edit_pos = len(self.C.edits)
+        self._compute_shortest_path()
+
+        total_cost = self.g.get(self.start, np.inf)
+        if total_cost == np.inf:
+            raise NoPathError("Goal node not reachable from start node")
+        path_list = [self.start]
+        while path_list[-1] != self.goal:
+            if len(path_list) > len(self.C):
+                raise Exception("Path extraction did not reach the goal")
+            path_list.append(min(self._neighbors(path_list[-1]), key=lambda pair: pair[1] + self.g.get(pair[0], np.inf))[0])
+        return path_list, total_cost
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    N = 200  # number of edits in the stream
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    start, goal = (int(place) for place in np.random.choice(places, 2, replace=False))
+    planner = DStarLite(C, start, goal, node_dist)
+    t0 = time.perf_counter()
+    path_list, cost = planner.plan()
+    print(f"Initial plan: {time.perf_counter() - t0:.5f} sec, cost = {cost:.3f}, {planner.expansions} expansions")
+
+    # random stream of edits: block edges on or near the current path, raise costs, reopen blocked edges
+    blocked = []
+    incremental_times = np.zeros(N)
+    scratch_times = np.zeros(N)
+    max_cost_difference = 0.
+    for idx in range(N):
+        event = np.random.choice(["block", "cost", "reopen"])
+        if event == "reopen" and blocked:
+            C.set_edge(*blocked.pop(np.random.randint(len(blocked))))
+        else:
+            node = path_list[np.random.randint(len(path_list) - 1)] if np.random.rand() < 0.5 else int(np.random.choice(places))
+            edges = list(C.neighbors(node))
+            if not edges:
+                continue
+            neighbor, edge_cost = edges[np.random.randint(len(edges))]
+            if event == "cost":
+                C.set_edge(node, neighbor, edge_cost * np.random.uniform(1., 3.))
+            else:
+                C.remove_edge(node, neighbor)
+                blocked.append((node, neighbor))
+
+        t1 = time.perf_counter()
+        try:
+            path_list, cost = planner.plan()
+        except NoPathError:
+            path_list, cost = [start, goal], np.inf
+        t2 = time.perf_counter()
+        try:
+            _, scratch_cost = get_info(*layer_astar(C, start, goal, node_dist))
+        except NoPathError:
+            scratch_cost = np.inf
+        t3 = time.perf_counter()
+        incremental_times[idx] = t2 - t1
+        scratch_times[idx] = t3 - t2
+        if cost < np.inf or scratch_cost < np.inf:
+            max_cost_difference = max(max_cost_difference, abs(cost - scratch_cost))
+
+    print(f"--- Replanning after {N} edits ---")
+    print(f"D* Lite time = {np.mean(incremental_times):.5f} +- {np.std(incremental_times):.5f} sec")
+    print(f"layer_astar from scratch time = {np.mean(scratch_times):.5f} +- {np.std(scratch_times):.5f} sec")
+    print(f"Speedup = {np.sum(scratch_times) / np.sum(incremental_times):.2f}x, max cost difference = {max_cost_difference:.2e}")
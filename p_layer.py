@@ -1,5 +1,6 @@
 import spark_dsg as dsg
 import pathlib
+from planning_index import load_planning_index
 
 # %%
 path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
@@ -7,19 +8,19 @@ path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
 
 
 # %%
-G = dsg.DynamicSceneGraph.load(str(path_to_dsg))
-dsg.add_bounding_boxes_to_layer(G, dsg.DsgLayers.ROOMS)
+C = load_planning_index(path_to_dsg)
 
-place_layer = G.get_layer(dsg.DsgLayers.ROOMS)
-print(f"Number of places: {place_layer.num_nodes()}")
-print(f"Number of edges between places: {place_layer.num_edges()}")
+place_layer = C.layer_nodes(dsg.DsgLayers.ROOMS)
+# every edge once, as (source, target, edge) with source < target
+edges = [(source, int(C.indices[edge]), edge) for source in place_layer.tolist()
+         for edge in range(C.indptr[source], C.indptr[source + 1]) if source < C.indices[edge]]
+print(f"Number of places: {len(place_layer)}")
+print(f"Number of edges between places: {len(edges)}")
 
-for edge in place_layer.edges:
-    source = G.get_node(edge.source)
-    target = G.get_node(edge.target)
+for source, target, edge in edges:
     print(source, target)
-    print(source.id, target.id)
-    print(source.attributes.position, target.attributes.position)
-    print(source.attributes.bounding_box, target.attributes.bounding_box)
-    print(edge.info.weight) # what is this?
-    break
\ No newline at end of file
+    print(C.ids[source], C.ids[target])
+    print(C.positions[source], C.positions[target])
+    print((C.bbox_min[source], C.bbox_max[source]), (C.bbox_min[target], C.bbox_max[target]))
+    print(C.weights[edge]) # edge weight, cost_models.CostModel(weight=...) adds it to the edge cost
+    break
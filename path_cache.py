@@ -0,0 +1,124 @@
+from astar import *
+from collections import OrderedDict
+
+
+class PathCache:
+    # Memoization for hierarchical_planner on a CompiledGraph:
+    # - shortest paths between all pairs of rooms, precomputed on the (tiny) room layer
+    # - LRU cache of single-source Dijkstra trees restricted to the room of the source
+    # Everything is tied to C.version and dropped once the graph changes.
+    def __init__(self, C, maxsize=1024):
+        self.C = C
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._build()
+
+    def _build(self):
+        self.version = self.C.version
+        self._rooms = self.C.rooms.tolist()
+        self._trees = OrderedDict()  # source place -> (path_dict, cost_to_come)
+        # room layer all-pairs shortest paths, one Dijkstra per room
+        self._room_trees = {}
+        for room in self.C.layer_nodes(dsg.DsgLayers.ROOMS).tolist():
+            _, path_dict, cost_to_come = astar_search(self.C, room, lambda node: False, lambda node: 0.)
+            self._room_trees[room] = (path_dict, cost_to_come)
+        # place edges that cross from one room into another
+        self._crossings = {}
+        for place in self.C.layer_nodes(dsg.DsgLayers.PLACES).tolist():
+            for neighbor, edge_cost in self.C.neighbors(place):
+                if self._rooms[neighbor] != self._rooms[place]:
+                    self._crossings.setdefault((self._rooms[place], self._rooms[neighbor]), []).append((place, neighbor, edge_cost))
+
+    def _check_version(self):
+        if self.version != self.C.version:
+            self._build()
+
+    def room_path(self, start_room, goal_room):
+        # table lookup of the shortest room sequence and its cost
+        self._check_version()
+        path_dict, cost_to_come = self._room_trees[start_room]
+        return get_info(goal_room, path_dict, cost_to_come)
+
+    def room_tree(self, source):
+        # Dijkstra tree of source inside its own room
+        self._check_version()
+        if source in self._trees:
+            self.hits += 1
+            self._trees.move_to_end(source)
+            return self._trees[source]
+        self.misses += 1
+        room = self._rooms[source]
+        def room_neighbors(node):
+            return [(neighbor, edge_cost) for neighbor, edge_cost in self.C.neighbors(node) if self._rooms[neighbor] == room]
+        _, path_dict, cost_to_come = astar_search(self.C, source, lambda node: False, lambda node: 0., room_neighbors)
+        self._trees[source] = (path_dict, cost_to_come)
+        if len(self._trees) > self.maxsize:
+            self._trees.popitem(last=False)
+            self.evictions += 1
+        return path_dict, cost_to_come
+
+    def place_to_place(self, source, goal):
+        # in-room path between two places of the same room, None if there is none
+        self._check_version()
+        if self._rooms[source] != self._rooms[goal]:
+            return None
+        path_dict, cost_to_come = self.room_tree(source)
+        if goal not in cost_to_come:
+            return None
+        return get_info(goal, path_dict, cost_to_come)
+
+    def place_to_room(self, source, goal_room, heuristic=None):
+        # In-room path from source over a place edge into goal_room, None if there is none.
+        # Takes the same entry place as the search of hierarchical_segments
+        # (naive_place_to_room_astar), the one with the smallest cost + heuristic to goal_room,
+        # which is the first place of goal_room that A* reaches; the cheapest entry if no
+        # heuristic is given. The path stays in the room of source until it crosses, so segments
+        # are the same as hierarchical_segments(corridor=True) plans without the cache; without
+        # the corridor that search may also go through other rooms and find a different segment.
+        self._check_version()
+        path_dict, cost_to_come = self.room_tree(source)
+        to_goal = (lambda node: 0.) if heuristic is None else heuristic_to(self.C, heuristic, [goal_room])
+        best = None
+        for place, neighbor, edge_cost in self._crossings.get((self._rooms[source], goal_room), []):
+            if place not in cost_to_come:
+                continue
+            cost = cost_to_come[place] + edge_cost
+            if best is None or cost + to_goal(neighbor) < best[3]:
+                best = (place, neighbor, cost, cost + to_goal(neighbor))
+        if best is None:
+            return None
+        path_list, _ = get_info(best[0], path_dict, cost_to_come)
+        path_list.append(best[1])
+        return path_list, best[2]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._trees)}
+
+    def clear(self):
+        self._trees.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    np.random.seed(0)
+    N = 500
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+    t0 = time.perf_counter()
+    cache = PathCache(C)
+    print(f"Room table precomputation: {time.perf_counter() - t0:.5f} sec")
+
+    # repeated queries between a handful of start and goal places, as a robot fleet would issue them
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = np.random.choice(places[C.rooms[places] >= 0], 20, replace=False)
+    pairs = places[np.random.randint(0, len(places), size=(N, 2))].tolist()
+    for name, kwargs in [("uncached", {}), ("cached", {"cache": cache})]:
+        t0 = time.perf_counter()
+        costs = [hierarchical_planner(C, start, goal, node_dist, **kwargs)[1] for start, goal in pairs]
+        print(f"{name}: {N / (time.perf_counter() - t0):.1f} queries/sec, mean cost = {np.mean(costs):.3f}")
+    print(f"Cache stats: {cache.stats()}")
@@ -0,0 +1,151 @@
+from astar import *
+from planning_index import load_planning_index
+
+
+def path_arrays(G, path_list):
+    # (node keys, xyz positions, free-space radii) of the nodes of a path, radius 0 for
+    # nodes without one (objects, places of maps without distances)
+    if isinstance(G, CompiledGraph):
+        keys = np.asarray(path_list, dtype=np.int64)
+        points = G.positions[keys]
+        radii = G.radii[keys]
+    else:
+        keys = np.array([node.id.value for node in path_list], dtype=np.uint64)
+        points = np.array([node.attributes.position for node in path_list], dtype=float).reshape(-1, 3)
+        radii = np.array([getattr(node.attributes, "distance", np.nan) if node.layer == dsg.DsgLayers.PLACES else np.nan
+                          for node in path_list], dtype=float)
+    return keys, np.asarray(points, dtype=float), np.nan_to_num(radii, nan=0.)
+
+
+def path_length(points):
+    # 2D length of a polyline, the same metric as node_dist
+    diff = np.diff(points[:, :2], axis=0)
+    return float(np.sum(np.hypot(diff[:, 0], diff[:, 1])))
+
+
+def loop_free_indices(keys):
+    # positions in keys of the loop-free path: nodes repeated at segment joins and everything
+    # between two visits of the same node are dropped. Every kept node jumps to right after
+    # its last visit, so consecutive kept nodes are still neighbors in the graph.
+    _, inverse = np.unique(keys, return_inverse=True)
+    last = np.zeros(inverse.max() + 1 if len(inverse) else 0, dtype=np.int64)
+    np.maximum.at(last, inverse, np.arange(len(keys)))
+    last = last[inverse].tolist()
+    kept = []
+    i = 0
+    while i < len(keys):
+        kept.append(i)
+        i = last[i] + 1
+    return np.array(kept, dtype=np.int64)
+
+
+def segments_free(starts, ends, centers, radii):
+    # whether every segment starts[j] -> ends[j] lies inside the union of the free-space
+    # balls (centers, radii). Each ball covers an interval [t0, t1] of the segment
+    # parameter, the segment is free if the intervals sorted by t0 chain from 0 to 1.
+    d = ends - starts  # (J, 3)
+    offset = starts[:, None, :] - centers[None, :, :]  # (J, K, 3)
+    a = np.maximum(np.sum(d * d, axis=1), 1e-12)[:, None]
+    b = np.einsum("jd,jkd->jk", d, offset)
+    c = np.sum(offset * offset, axis=2) - radii[None, :] ** 2
+    disc = b * b - a * c
+    root = np.sqrt(np.maximum(disc, 0.))
+    t0 = np.where(disc >= 0., (-b - root) / a, np.inf)
+    t1 = np.where(disc >= 0., (-b + root) / a, -np.inf)
+    order = np.argsort(t0, axis=1)
+    t0 = np.take_along_axis(t0, order, axis=1)
+    reach = np.maximum.accumulate(np.take_along_axis(t1, order, axis=1), axis=1)
+    # coverage ends at the first gap between the reach so far and the next interval
+    gaps = t0[:, 1:] > reach[:, :-1]
+    end = np.where(np.any(gaps, axis=1), reach[np.arange(len(d)), np.argmax(gaps, axis=1)], reach[:, -1])
+    return (t0[:, 0] <= 0.) & (end >= 1.)
+
+
+def shortcut_path(points, radii):
+    # positions of the waypoints kept by greedy line-of-sight shortcutting: from every kept
+    # waypoint, jump to the farthest later one that is reachable in a straight line through
+    # free space. Consecutive path nodes are always kept reachable (they share a graph edge).
+    balls = radii > 0.
+    centers, ball_radii = points[balls], radii[balls]
+    kept = [0]
+    i = 0
+    while i < len(points) - 1:
+        candidates = np.arange(i + 2, len(points))
+        j = i + 1
+        if len(candidates) and len(centers):
+            free = segments_free(np.repeat(points[i:i + 1], len(candidates), axis=0), points[candidates], centers, ball_radii)
+            if np.any(free):
+                j = int(candidates[np.flatnonzero(free)[-1]])
+        kept.append(j)
+        i = j
+    return np.array(kept, dtype=np.int64)
+
+
+def resample_path(points, step):
+    # points every step meters (2D arc length) along the polyline, the last point included
+    diff = np.diff(points[:, :2], axis=0)
+    arc = np.concatenate(([0.], np.cumsum(np.hypot(diff[:, 0], diff[:, 1]))))
+    if arc[-1] == 0.:
+        return points[:1].copy()
+    samples = np.append(np.arange(0., arc[-1], step), arc[-1])
+    return np.stack([np.interp(samples, arc, points[:, dim]) for dim in range(points.shape[1])], axis=1)
+
+
+def smooth_path(G, path_list, step=None, shortcut=True):
+    # Post-processing of a planned path_list (get_info, hierarchical_planner, ...): removes
+    # loops and repeated joins, shortcuts over places whose free-space balls cover the
+    # straight line, and resamples to one point every step meters if step is given.
+    # Returns (waypoints, points, report): the path nodes kept, the xyz points to follow
+    # and a dict with the path length before and after.
+    keys, points, radii = path_arrays(G, path_list)
+    input_cost = path_length(points)
+    kept = loop_free_indices(keys)
+    loops_removed = len(keys) - len(kept)
+    if shortcut and len(kept) > 2:
+        kept = kept[shortcut_path(points[kept], radii[kept])]
+    waypoints = [path_list[i] for i in kept.tolist()]
+    points = points[kept]
+    cost = path_length(points)
+    if step is not None:
+        points = resample_path(points, step)
+    report = {"input_cost": input_cost, "cost": cost, "reduction": input_cost - cost,
+              "reduction_ratio": (input_cost - cost) / input_cost if input_cost > 0. else 0.,
+              "input_nodes": len(keys), "loops_removed": loops_removed, "waypoints": len(waypoints), "points": len(points)}
+    return waypoints, points, report
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    N = 200
+    step = 0.25  # m
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+    if not np.any(C.radii > 0.):
+        print("No free-space distances on the places, only loops are removed")
+
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    pairs = places[np.random.randint(0, len(places), size=(N, 2))].tolist()
+    for name, planner in [("layer_astar", lambda start, goal: get_info(*layer_astar(C, start, goal, node_dist))),
+                          ("hierarchical_planner", lambda start, goal: hierarchical_planner(C, start, goal, node_dist))]:
+        reports = []
+        times = []
+        for start, goal in pairs:
+            try:
+                path_list, _ = planner(start, goal)
+            except Exception:
+                continue
+            t0 = time.perf_counter()
+            _, _, report = smooth_path(C, path_list, step)
+            times.append(time.perf_counter() - t0)
+            reports.append(report)
+        ratios = np.array([report["reduction_ratio"] for report in reports])
+        loops = np.array([report["loops_removed"] for report in reports])
+        nodes = np.array([report["waypoints"] / report["input_nodes"] for report in reports])
+        print(f"--- {name} ({len(reports)} paths) ---")
+        print(f"Cost reduction = {np.mean(ratios):.2%} +- {np.std(ratios):.2%} (max {np.max(ratios):.2%})")
+        print(f"Loops removed per path = {np.mean(loops):.2f}, waypoints kept = {np.mean(nodes):.1%}")
+        print(f"Smoothing time = {np.mean(times):.5f} +- {np.std(times):.5f} sec")
+        print()
@@ -0,0 +1,62 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class PlannerStats:
+    # Optional counters and timers for the planners in astar.py, pass stats=PlannerStats()
+    # to collect them. Search counters are derived from the heap and closed set when a
+    # search ends, so the inner loops are the same with and without stats. Phases can
+    # nest, the search phases of hierarchical_planner are part of room_level and segments.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.searches = 0
+        self.expansions = 0  # nodes closed
+        self.pushes = 0  # heap entries pushed
+        self.stale_pops = 0  # popped entries of already closed nodes (lazy deletion)
+        self.get_node_calls = 0  # node.id.value -> node lookups, DSG planning only
+        self.fallbacks = 0  # corridor searches that found no path and were repeated without the corridor
+        self.pruned = 0  # frontier entries dropped by the memory cap of bounded_astar
+        self.frontier_bytes = 0  # largest frontier of a bounded_astar search [bytes]
+        self.phases = {}  # phase name -> total time [ns]
+        self.segments = []  # one dict per hierarchical_planner segment
+
+    def add_search(self, expansions, pushes, pops):
+        self.searches += 1
+        self.expansions += expansions
+        self.pushes += pushes
+        self.stale_pops += pops - expansions
+
+    def merge(self, other):
+        # adds the counters and phase times of other, e.g. of a search run on another thread or process
+        for name in ["searches", "expansions", "pushes", "stale_pops", "get_node_calls", "fallbacks", "pruned"]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.frontier_bytes = max(self.frontier_bytes, other.frontier_bytes)
+        for name, total in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0) + total
+        self.segments.extend(other.segments)
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter_ns()
+        try:
+            yield self
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter_ns() - t0
+
+    def as_dict(self):
+        return {"searches": self.searches, "expansions": self.expansions, "pushes": self.pushes,
+                "stale_pops": self.stale_pops, "get_node_calls": self.get_node_calls,
+                "fallbacks": self.fallbacks, "pruned": self.pruned, "frontier_bytes": self.frontier_bytes,
+                **{f"{name}_ns": total for name, total in self.phases.items()}}
+
+    def __repr__(self):
+        return f"PlannerStats({', '.join(f'{key}={value}' for key, value in self.as_dict().items())})"
+
+
+def phase(stats, name):
+    # stats.phase(name), or a context that does nothing without stats
+    if stats is None:
+        return nullcontext()
+    return stats.phase(name)
@@ -0,0 +1,110 @@
+import spark_dsg as dsg
+import numpy as np
+import pathlib
+import hashlib
+import time
+import os
+import shutil
+import tempfile
+from compiled_graph import CompiledGraph, compile_graph
+
+
+INDEX_ARRAYS = ["ids", "layers", "positions", "indptr", "indices", "lengths", "parents", "names", "bbox_min", "bbox_max", "radii", "weights"]
+
+
+def dsg_hash(path_to_dsg):
+    # sha256 of the dsg.json contents, the index is rebuilt whenever it changes
+    digest = hashlib.sha256()
+    with open(path_to_dsg, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dsg_stat(path_to_dsg):
+    # mtime and size of dsg.json, the contents are only hashed again when one of them changes
+    stat = os.stat(path_to_dsg)
+    return f"{stat.st_mtime_ns} {stat.st_size}"
+
+
+def _write_text(path, text):
+    # replaced in one step, concurrent loaders read the old or the new contents
+    tmp = path.with_name(f".{path.name}.{os.getpid()}")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def index_dir(path_to_dsg):
+    # the index lives next to dsg.json, e.g. backend/dsg_planning_index/
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    return path_to_dsg.parent / f"{path_to_dsg.stem}_planning_index"
+
+
+def save_planning_index(C, directory, content_hash, file_stat=""):
+    # written to a temporary directory next to the index and renamed into place, so other
+    # processes never see (or memory-map) a half written index. file_stat: dsg_stat() of the
+    # dsg.json the index was built from
+    directory = pathlib.Path(directory)
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix=f".{directory.name}.", dir=directory.parent))
+    state = C.__getstate__()
+    for name in INDEX_ARRAYS:
+        np.save(tmp / f"{name}.npy", state[name])
+    (tmp / "hash.txt").write_text(content_hash)
+    (tmp / "stat.txt").write_text(file_stat)
+    old = directory.with_name(f".{directory.name}.{os.getpid()}.old")
+    try:
+        os.rename(directory, old)  # mapped files of the old index stay valid for their readers
+    except FileNotFoundError:
+        pass
+    try:
+        os.rename(tmp, directory)
+    except OSError:  # another process installed its index in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def load_planning_index(path_to_dsg, mmap_mode="r"):
+    # Compiled graph of dsg.json without parsing the JSON: arrays are memory-mapped from the
+    # index next to the file, so processes loading the same map share their pages. The index
+    # is (re)built from the DSG the first time and whenever the contents of dsg.json change.
+    # dsg.json is only read (and hashed) if its mtime or size changed since the index was built.
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    directory = index_dir(path_to_dsg)
+    file_stat = dsg_stat(path_to_dsg)
+    hash_file, stat_file = directory / "hash.txt", directory / "stat.txt"
+    content_hash = None
+    if hash_file.exists() and all((directory / f"{name}.npy").exists() for name in INDEX_ARRAYS):
+        fresh = stat_file.exists() and stat_file.read_text() == file_stat
+        if not fresh:  # touched or copied, the index is still valid if the contents are the same
+            content_hash = dsg_hash(path_to_dsg)
+            fresh = hash_file.read_text() == content_hash
+            if fresh:
+                _write_text(stat_file, file_stat)
+        if fresh:
+            return CompiledGraph(**{name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in INDEX_ARRAYS}, mapped=mmap_mode is not None)
+
+    content_hash = dsg_hash(path_to_dsg) if content_hash is None else content_hash
+    G = dsg.DynamicSceneGraph.load(str(path_to_dsg))
+    dsg.add_bounding_boxes_to_layer(G, dsg.DsgLayers.ROOMS)
+    C = compile_graph(G)
+    save_planning_index(C, directory, content_hash, file_stat)
+    return C
+
+
+if __name__ == "__main__":
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+
+    t0 = time.perf_counter()
+    G = dsg.DynamicSceneGraph.load(str(path_to_dsg))
+    dsg.add_bounding_boxes_to_layer(G, dsg.DsgLayers.ROOMS)
+    C = compile_graph(G)
+    print(f"JSON load + compile: {time.perf_counter() - t0:.5f} sec")
+
+    t0 = time.perf_counter()
+    C = load_planning_index(path_to_dsg)
+    print(f"load_planning_index (first run builds the index): {time.perf_counter() - t0:.5f} sec")
+    t0 = time.perf_counter()
+    C = load_planning_index(path_to_dsg)
+    print(f"load_planning_index (memory-mapped): {time.perf_counter() - t0:.5f} sec ({len(C)} nodes)")
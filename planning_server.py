@@ -0,0 +1,286 @@
+import spark_dsg as dsg
+import numpy as np
+import pathlib
+import asyncio
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from astar import node_dist, layer_astar
+from batch_planning import load_compiled, plan_query, planning_pool, _run_query
+from planning_index import load_planning_index
+
+
+class QueryCancelled(Exception):
+    # the server dropped the query (the robot sent a newer goal or the server stopped), unlike
+    # asyncio.CancelledError this does not mean that the awaiting task is being cancelled
+    pass
+
+
+class _Request:
+    # one planned (start, goal) pair, shared by every caller asking for it while in flight
+    def __init__(self, key, future, deadline):
+        self.key = key
+        self.future = future
+        self.deadline = deadline  # loop.time() after which planning is not started any more, None for no deadline
+        self.waiters = set()
+
+
+class PlanningServer:
+    # Serves planning queries between node.id.values against one compiled graph that stays
+    # in memory. Queries are queued and run on a pool of processes (each memory-maps the
+    # planning index or gets a copy of the compiled graph once) or threads. Identical
+    # queries in flight are planned once, a robot's new goal cancels its previous query,
+    # and queries whose deadline passed before a worker was free are dropped.
+    def __init__(self, G, method=layer_astar, heuristic=node_dist, workers=None, processes=True):
+        self.C = load_compiled(G)
+        self.method = method
+        self.heuristic = heuristic
+        self.workers = os.cpu_count() if workers is None else workers
+        if processes:
+            # workers load the index from disk when G is a path, neither the graph nor the
+            # method and heuristic are pickled per query
+            self._executor = planning_pool(G if isinstance(G, (str, pathlib.Path)) else self.C, self.workers, method, heuristic)
+            self._run = _run_query
+        else:
+            self._executor = ThreadPoolExecutor(self.workers)
+            self._run = partial(plan_query, self.C, method=method, heuristic=heuristic)
+        self._queue = None
+        self._tasks = []
+        self._inflight = {}  # (start, goal) -> _Request
+        self._robots = {}  # robot -> (request, token) of its current query
+        self.counts = {"requests": 0, "planned": 0, "deduplicated": 0, "cancelled": 0, "expired": 0, "failed": 0}
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for request in list(self._inflight.values()):
+            request.future.cancel()
+        self._inflight.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            request = await self._queue.get()
+            if request.future.done():  # cancelled while queued
+                continue
+            if request.deadline is not None and loop.time() > request.deadline:
+                self.counts["expired"] += 1
+                self._finish(request)
+                request.future.set_exception(TimeoutError("Deadline passed before planning started"))
+                continue
+            try:
+                result = await loop.run_in_executor(self._executor, self._run, *request.key)
+            except Exception as e:
+                result = e
+            self._finish(request)
+            if request.future.done():  # cancelled while planning, the result is outdated
+                continue
+            if isinstance(result, Exception):
+                self.counts["failed"] += 1
+                request.future.set_exception(result)
+            else:
+                self.counts["planned"] += 1
+                request.future.set_result(result)
+
+    def _finish(self, request):
+        if self._inflight.get(request.key) is request:
+            del self._inflight[request.key]
+
+    def _release(self, request, token):
+        # a caller stopped waiting, the query is cancelled once nobody waits for it
+        request.waiters.discard(token)
+        if not request.waiters and not request.future.done():
+            self.counts["cancelled"] += 1
+            self._finish(request)
+            request.future.cancel()
+
+    async def plan(self, start_value, goal_value, robot=None, timeout=None):
+        # (path as node.id.values, cost) from start to goal. robot: callers with the same robot
+        # only care about their latest goal, the previous query of the robot is cancelled.
+        # timeout: seconds until asyncio.TimeoutError, the query is not started after that.
+        # Raises QueryCancelled if the server drops the query.
+        if self._queue is None:
+            raise Exception("Planning server is not started")
+        loop = asyncio.get_running_loop()
+        key = (int(start_value), int(goal_value))
+        deadline = None if timeout is None else loop.time() + timeout
+        token = object()
+        self.counts["requests"] += 1
+
+        request = self._inflight.get(key)
+        if request is None:
+            request = _Request(key, loop.create_future(), deadline)
+            self._inflight[key] = request
+            self._queue.put_nowait(request)
+        else:
+            self.counts["deduplicated"] += 1
+            request.deadline = None if deadline is None or request.deadline is None else max(request.deadline, deadline)
+        request.waiters.add(token)
+        if robot is not None:
+            previous = self._robots.get(robot)
+            self._robots[robot] = (request, token)
+            if previous is not None:
+                self._release(*previous)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(request.future), timeout)
+        except asyncio.CancelledError:
+            if request.future.cancelled():  # dropped by the server, not this task being cancelled
+                raise QueryCancelled("Query was cancelled by the server") from None
+            raise
+        finally:
+            if robot is not None and self._robots.get(robot, (None, None))[1] is token:
+                del self._robots[robot]
+            self._release(request, token)
+
+    async def _handle_connection(self, reader, writer):
+        # newline-delimited JSON: {"id", "start", "goal", "robot", "timeout"} in, {"id", "path", "cost"}
+        # or {"id", "error"} out, answers are written as soon as each query is done
+        async def answer(message):
+            try:
+                path, cost = await self.plan(message["start"], message["goal"], message.get("robot"), message.get("timeout"))
+                response = {"id": message["id"], "path": path, "cost": cost}
+            except QueryCancelled:
+                response = {"id": message["id"], "error": "cancelled"}
+            except asyncio.TimeoutError:
+                response = {"id": message["id"], "error": "timeout"}
+            except Exception as e:
+                response = {"id": message["id"], "error": str(e) or type(e).__name__}
+            writer.write((json.dumps(response) + "\n").encode())
+            await writer.drain()
+
+        pending = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(answer(json.loads(line)))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=0):
+        # local socket server, returns the asyncio.Server (server.sockets[0].getsockname() for the port)
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+
+class PlanningClient:
+    # client of a PlanningServer socket, several queries can be in flight at once
+    def __init__(self, host="127.0.0.1", port=8765):
+        self.host = host
+        self.port = port
+        self._ids = itertools.count()
+        self._pending = {}  # request id -> future
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._reader_task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        while line := await self._reader.readline():
+            response = json.loads(line)
+            future = self._pending.pop(response["id"], None)
+            if future is None or future.done():
+                continue
+            if "error" in response:
+                future.set_exception(QueryCancelled("Query was cancelled by the server") if response["error"] == "cancelled" else
+                                     asyncio.TimeoutError() if response["error"] == "timeout" else Exception(response["error"]))
+            else:
+                future.set_result((response["path"], response["cost"]))
+        # the server closed the connection, nothing will answer the queries still in flight
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Planning server closed the connection"))
+
+    async def plan(self, start_value, goal_value, robot=None, timeout=None):
+        if self._reader_task.done():
+            raise ConnectionError("Planning server closed the connection")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        message = {"id": request_id, "start": int(start_value), "goal": int(goal_value), "robot": robot, "timeout": timeout}
+        self._writer.write((json.dumps(message) + "\n").encode())
+        await self._writer.drain()
+        return await future
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._reader_task.cancel()
+
+
+async def generate_load(plan, pairs, concurrency=16, rate=None, robots=None, timeout=None, seed=0):
+    # Sends every (start, goal) pair through plan (PlanningServer.plan or PlanningClient.plan)
+    # with at most concurrency queries in flight, or with Poisson arrivals of rate queries/sec
+    # if rate is given. robots: optional robot of every pair, so newer goals of the same robot
+    # cancel older ones. Returns the latency of every query (nan if it did not return a path)
+    # and the throughput in queries/sec.
+    latencies = np.full(len(pairs), np.nan)
+    semaphore = asyncio.Semaphore(concurrency if rate is None else len(pairs))
+    send_times = None if rate is None else np.cumsum(np.random.default_rng(seed).exponential(1. / rate, len(pairs)))
+
+    async def run(idx, start_value, goal_value):
+        if send_times is not None:
+            await asyncio.sleep(t0 + send_times[idx] - time.perf_counter())
+        async with semaphore:
+            sent = time.perf_counter()
+            try:
+                await plan(start_value, goal_value, robot=None if robots is None else robots[idx], timeout=timeout)
+            except Exception:  # timed out, cancelled by the server (QueryCancelled) or failed
+                return
+            latencies[idx] = time.perf_counter() - sent
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(run(idx, start_value, goal_value) for idx, (start_value, goal_value) in enumerate(pairs)))
+    return latencies, len(pairs) / (time.perf_counter() - t0)
+
+
+def print_load_results(name, latencies, throughput):
+    done = latencies[~np.isnan(latencies)]
+    p50, p90, p99 = np.percentile(done, [50, 90, 99]) if len(done) else (np.nan, np.nan, np.nan)
+    print(f"{name}: {throughput:.1f} queries/sec, {len(done)}/{len(latencies)} answered, "
+          f"latency p50 = {p50 * 1e3:.2f} ms, p90 = {p90 * 1e3:.2f} ms, p99 = {p99 * 1e3:.2f} ms")
+
+
+async def main(path_to_dsg, N, num_robots=8, concurrency=32):
+    rng = np.random.default_rng(0)
+    C = load_planning_index(path_to_dsg)
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    # queries repeat, so identical ones are in flight at the same time
+    distinct_pairs = rng.choice(places, (max(N // 4, 1), 2))
+    pairs = C.ids[distinct_pairs[rng.integers(0, len(distinct_pairs), N)]].tolist()
+    robots = rng.integers(0, num_robots, N).tolist()
+
+    server = PlanningServer(path_to_dsg)
+    await server.start()
+    latencies, throughput = await generate_load(server.plan, pairs, concurrency)
+    print_load_results("In-process queue", latencies, throughput)
+    # robots sending new goals near the capacity of the server, outdated goals get cancelled
+    print_load_results("In-process queue, robots", *await generate_load(server.plan, pairs, rate=throughput, robots=robots))
+
+    socket_server = await server.serve()
+    client = PlanningClient(port=socket_server.sockets[0].getsockname()[1])
+    await client.connect()
+    print_load_results("Local socket", *await generate_load(client.plan, pairs, concurrency))
+    await client.close()
+    socket_server.close()
+    await server.stop()
+    print(server.counts)
+
+
+if __name__ == "__main__":
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    asyncio.run(main(path_to_dsg, N=2000))
@@ -0,0 +1,140 @@
+from astar import *
+from compiled_graph import compile_graph
+
+
+class PortalGraph:
+    # Room-level abstraction of the place layer (HPA*). Portals are places with a
+    # sibling in another room. Portals of the same room are connected by their
+    # in-room shortest path cost, portals of adjacent rooms by the place edge itself.
+    def __init__(self, C):
+        self.C = C
+        self.version = C.version
+        self._rooms = C.rooms.tolist()
+        self.portals = {}  # room -> list of portal places
+        self.edges = {}  # portal -> list of (portal, cost)
+        self.paths = {}  # (portal, portal) -> place path of an intra-room edge
+
+        for place in C.layer_nodes(dsg.DsgLayers.PLACES).tolist():
+            for neighbor, edge_cost in C.neighbors(place):
+                if self._rooms[neighbor] != self._rooms[place]:
+                    self.edges.setdefault(place, []).append((neighbor, edge_cost))
+        for place in self.edges:
+            self.portals.setdefault(self._rooms[place], []).append(place)
+
+        for room, room_portals in self.portals.items():
+            for portal in room_portals:
+                path_dict, cost_to_come = self.room_tree(portal, room_portals)
+                for other_portal in room_portals:
+                    if other_portal != portal and other_portal in cost_to_come:
+                        self.edges[portal].append((other_portal, cost_to_come[other_portal]))
+                        self.paths[(portal, other_portal)], _ = get_info(other_portal, path_dict, cost_to_come)
+
+    def room_neighbors(self, node):
+        # siblings of node that lie in the same room
+        room = self._rooms[node]
+        return [(neighbor, edge_cost) for neighbor, edge_cost in self.C.neighbors(node) if self._rooms[neighbor] == room]
+
+    def room_tree(self, source, targets, stats=None):
+        # in-room Dijkstra from source, stops once every target is settled
+        remaining = set(targets)
+        def is_goal(node):
+            remaining.discard(node)
+            return not remaining
+        _, path_dict, cost_to_come = astar_search(self.C, source, is_goal, lambda node: 0., self.room_neighbors, stats)
+        return path_dict, cost_to_come
+
+    def num_portals(self):
+        return len(self.edges)
+
+
+def build_portal_graph(G):
+    # precomputation stage, G is a DSG or a CompiledGraph
+    if not isinstance(G, CompiledGraph):
+        G = compile_graph(G)
+    return PortalGraph(G)
+
+
+def portal_planner(P, start_node, goal_node, heuristic, stats=None):
+    # HPA* query: connect start and goal to the portals of their rooms, search the
+    # portal graph and unpack the abstract edges into place paths
+    C = P.C
+    if P.version != C.version:
+        raise Exception("Portal graph is out of date, rebuild it after editing the graph")
+    start_node = C.resolve(start_node)
+    goal_node = C.resolve(goal_node)
+    if C.layers[start_node] != 3:
+        raise Exception("Start node is not a place")
+    if C.layers[goal_node] != 3:
+        raise Exception("Goal node is not a place")
+
+    start_room, goal_room = P._rooms[start_node], P._rooms[goal_node]
+    start_targets = P.portals.get(start_room, []) + ([goal_node] if start_room == goal_room else [])
+    with phase(stats, "connect"):
+        start_dict, start_cost = P.room_tree(start_node, start_targets, stats)
+        goal_dict, goal_cost = P.room_tree(goal_node, P.portals.get(goal_room, []), stats)
+    local_edges = {start_node: [(node, start_cost[node]) for node in start_targets if node in start_cost]}
+    for portal in P.portals.get(goal_room, []):
+        if portal in goal_cost:
+            local_edges.setdefault(portal, []).append((goal_node, goal_cost[portal]))
+
+    def neighbors(node):
+        return P.edges.get(node, []) + local_edges.get(node, [])
+    with phase(stats, "heuristic"):
+        to_goal = heuristic_to(C, heuristic, [goal_node])
+    with phase(stats, "search"):
+        _, path_dict, cost_to_come = astar_search(C, start_node, lambda node: node == goal_node, to_goal, neighbors, stats)
+    if goal_node not in cost_to_come:
+        raise NoPathError("Goal node not reachable from start node")
+    abstract_path, total_cost = get_info(goal_node, path_dict, cost_to_come)
+
+    total_path_list = [start_node]
+    for node1, node2 in zip(abstract_path[:-1], abstract_path[1:]):
+        if P._rooms[node1] != P._rooms[node2]:
+            path_segment = [node1, node2]
+        elif node1 == start_node:
+            path_segment, _ = get_info(node2, start_dict, start_cost)
+        elif node2 == goal_node:
+            path_segment, _ = get_info(node1, goal_dict, goal_cost)
+            path_segment.reverse()
+        else:
+            path_segment = P.paths[(node1, node2)]
+        total_path_list.extend(path_segment[1:])
+    return total_path_list, total_cost
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    np.random.seed(0)
+    N = 200
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    t0 = time.perf_counter()
+    P = build_portal_graph(C)
+    print(f"Portal graph precomputation: {time.perf_counter() - t0:.5f} sec ({P.num_portals()} portals, {len(P.paths)} intra-room edges)")
+
+    # cross-room queries only, that is where the hierarchical planner loses the most
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    pairs = places[np.random.randint(0, len(places), size=(4 * N, 2))]
+    pairs = pairs[C.rooms[pairs[:, 0]] != C.rooms[pairs[:, 1]]][:N]
+
+    results = {}
+    for name, planner, graph in [("layer_astar", layer_astar, C), ("hierarchical_planner", hierarchical_planner, C), ("portal_planner", portal_planner, P)]:
+        times = np.zeros(len(pairs))
+        costs = np.zeros(len(pairs))
+        for idx, (start, goal) in enumerate(pairs.tolist()):
+            t1 = time.perf_counter()
+            if planner == layer_astar:
+                _, costs[idx] = get_info(*planner(graph, start, goal, node_dist))
+            else:
+                _, costs[idx] = planner(graph, start, goal, node_dist)
+            times[idx] = time.perf_counter() - t1
+        results[name] = (times, costs)
+
+    optimal_costs = results["layer_astar"][1]
+    print(f"--- Cross_room results ({len(pairs)}) ---")
+    for name, (times, costs) in results.items():
+        print(f"{name}: time = {np.mean(times):.5f} +- {np.std(times):.5f} sec, cost ratio = {np.mean(costs / optimal_costs):.4f} (max {np.max(costs / optimal_costs):.4f})")
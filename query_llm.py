@@ -1,9 +1,17 @@
-from transformers import pipeline
+_generators = {}  # model name -> loaded text-generation pipeline
+
+
+def load_model(model_name='mistralai/Mistral-7B-v0.1'):
+    # transformers is only imported (and the model only loaded) on first use, once per model
+    if model_name not in _generators:
+        from transformers import pipeline
+        _generators[model_name] = pipeline('text-generation', model=model_name)
+    return _generators[model_name]
 
 
 def query_model(question, model_name='mistralai/Mistral-7B-v0.1'):
     # Initialize the model and tokenizer
-    generator = pipeline('text-generation', model=model_name)
+    generator = load_model(model_name)
 
     # Generate the response
     response = generator(question, truncation=True, max_length=50, num_return_sequences=1)
@@ -12,10 +20,18 @@ def query_model(question, model_name='mistralai/Mistral-7B-v0.1'):
     return response[0]['generated_text']
 
 
-objects = ["fan", "papers", "keyboard", "laptop", "mouse", "trashcan", "chair", "plant", "painting", "couch"]
-question = "I want to sit comfortably, where shall I go?"
-options_prompt = "Please choose from the following options: " + ", ".join(objects) + ". Please only type the name of the object."
-prompt = question + " " + options_prompt
-print("Prompt: ", prompt)
-# response = query_model(prompt, 'mistralai/Mistral-7B-v0.1')
-# print("Response: ", response)
+def query_model_batch(questions, model_name='mistralai/Mistral-7B-v0.1', batch_size=8):
+    # several questions, batch_size of them per forward pass
+    generator = load_model(model_name)
+    responses = generator(list(questions), truncation=True, max_length=50, num_return_sequences=1, batch_size=batch_size)
+    return [response[0]['generated_text'] for response in responses]
+
+
+if __name__ == "__main__":
+    objects = ["fan", "papers", "keyboard", "laptop", "mouse", "trashcan", "chair", "plant", "painting", "couch"]
+    question = "I want to sit comfortably, where shall I go?"
+    options_prompt = "Please choose from the following options: " + ", ".join(objects) + ". Please only type the name of the object."
+    prompt = question + " " + options_prompt
+    print("Prompt: ", prompt)
+    # response = query_model(prompt, 'mistralai/Mistral-7B-v0.1')
+    # print("Response: ", response)
@@ -0,0 +1,132 @@
+import spark_dsg as dsg
+import numpy as np
+import pathlib
+import time
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from compiled_graph import CompiledGraph, compile_graph
+
+
+ROOM_COLORS = [
+    "#f4c2c2",  # Light Pink
+    "#ace1af",  # Soft Celadon Green
+    "#add8e6",  # Light Blue
+    "#bdb76b",  # Dark Khaki
+    "#ffe4e1",  # Misty Rose
+    "#77dd77",  # Pastel Green
+    "#fdd5b1",  # Light Apricot
+    "#9f79ee",  # Medium Purple
+    "#cfcfc4"   # Pastel Gray
+]
+
+
+def as_compiled(G):
+    return G if isinstance(G, CompiledGraph) else compile_graph(G)
+
+
+def layer_edges(C, layer):
+    # (E, 2) node index pairs of the sibling edges in layer, every edge once
+    indptr, indices, _ = C.csr()
+    sources = np.repeat(np.arange(len(C)), np.diff(indptr))
+    mask = (sources < indices) & (C.layers[sources] == layer)
+    return np.stack((sources[mask], indices[mask]), axis=1)
+
+
+def node_colors(C, nodes, colors=ROOM_COLORS):
+    # rgba color of the room of every node (by position of the room in the room layer), gray without one
+    rooms = C.layer_nodes(dsg.DsgLayers.ROOMS)
+    room_order = np.full(len(C), -1, dtype=np.int64)
+    room_order[rooms] = np.arange(len(rooms))
+    order = np.where(C.rooms[nodes] >= 0, room_order[C.rooms[nodes]], -1)
+    palette = to_rgba_array(colors + ["#808080"])
+    return palette[np.where(order >= 0, order % len(colors), len(colors))]
+
+
+def path_points(C, path):
+    # xy points of a path: compiled indices, DSG nodes, or an (n, 2|3) point array (smooth_path)
+    if isinstance(path, np.ndarray) and path.dtype.kind == "f":
+        return path[:, :2]
+    nodes = [C.resolve(node) for node in path]
+    return C.positions[nodes, :2]
+
+
+def draw_graph(G, layer=dsg.DsgLayers.PLACES, ax=None, room_labels=True, node_size=4, edge_alpha=0.25, node_alpha=0.25, linewidth=0.3):
+    # every node of layer with one scatter and every edge with one LineCollection, colored by room
+    C = as_compiled(G)
+    ax = plt.gca() if ax is None else ax
+    nodes = C.layer_nodes(layer)
+    edges = layer_edges(C, layer)
+    edge_colors = node_colors(C, edges[:, 0])
+    edge_colors[:, 3] = edge_alpha
+    ax.add_collection(LineCollection(C.positions[edges][:, :, :2], colors=edge_colors, linewidths=linewidth))
+    colors = node_colors(C, nodes)
+    colors[:, 3] = node_alpha
+    ax.scatter(C.positions[nodes, 0], C.positions[nodes, 1], s=node_size, c=colors, linewidths=0)
+    if room_labels:
+        rooms = C.layer_nodes(dsg.DsgLayers.ROOMS)
+        room_colors = node_colors(C, rooms)
+        room_colors[:, 3] = 0.8
+        ax.scatter(C.positions[rooms, 0], C.positions[rooms, 1], s=25, c=room_colors, linewidths=0)
+        for i, (room, color) in enumerate(zip(rooms.tolist(), room_colors)):
+            ax.text(C.positions[room, 0] - 0.5, C.positions[room, 1] + 0.5, f"$R_{i}$", color=color[:3], fontsize=11)
+    ax.autoscale_view()
+    return ax
+
+
+def draw_paths(G, paths, ax=None, color="green", linewidth=2, alpha=1., markers=True, marker_size=25, label=None, cmap=None):
+    # Draws a whole set of paths with one LineCollection (and one scatter for their nodes).
+    # color is one color for every path, or per path values mapped through cmap.
+    C = as_compiled(G)
+    ax = plt.gca() if ax is None else ax
+    if cmap is not None:
+        path_colors = plt.get_cmap(cmap)(plt.Normalize()(np.asarray(color, dtype=float)))
+    else:
+        path_colors = to_rgba_array(color)
+        if len(path_colors) == 1:
+            path_colors = np.repeat(path_colors, len(paths), axis=0)
+    points = [path_points(C, path) for path in paths]
+    keep = [i for i, path in enumerate(points) if len(path)]
+    if not keep:
+        return ax
+    points = [points[i] for i in keep]
+    path_colors = path_colors[keep]
+    counts = np.array([len(path) for path in points])
+    segments = np.concatenate([np.stack((path[:-1], path[1:]), axis=1) for path in points])
+    path_colors[:, 3] *= alpha
+    ax.add_collection(LineCollection(segments, colors=np.repeat(path_colors, counts - 1, axis=0), linewidths=linewidth, label=label))
+    if markers:
+        xy = np.concatenate(points)
+        ax.scatter(xy[:, 0], xy[:, 1], s=marker_size, c=np.repeat(path_colors, counts, axis=0), linewidths=0)
+    ax.autoscale_view()
+    return ax
+
+
+if __name__ == "__main__":
+    from astar import get_info, node_dist, layer_astar
+    from planning_index import load_planning_index
+    np.random.seed(0)
+    N = 500
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    places = C.layer_nodes(dsg.DsgLayers.PLACES)
+    places = places[C.rooms[places] >= 0]
+    paths, costs = [], []
+    for start, goal in places[np.random.randint(0, len(places), size=(N, 2))].tolist():
+        try:
+            path_list, cost = get_info(*layer_astar(C, start, goal, node_dist))
+        except Exception:
+            continue
+        paths.append(path_list)
+        costs.append(cost)
+
+    plt.figure(figsize=(8, 8))
+    t0 = time.perf_counter()
+    draw_graph(C)
+    draw_paths(C, paths, color=costs, cmap="viridis", linewidth=0.5, alpha=0.3, markers=False)
+    plt.gca().set_aspect('equal', adjustable='box')
+    plt.savefig("plots/benchmark_paths.png")
+    print(f"Rendered {len(C.layer_nodes(dsg.DsgLayers.PLACES))} places and {len(paths)} paths in {time.perf_counter() - t0:.3f} sec")
@@ -0,0 +1,180 @@
+from astar import *
+from compiled_graph import compile_graph
+
+
+class SpatialIndex:
+    # Uniform grid over the xy positions of the places and the room bounding boxes of a
+    # CompiledGraph. Places are sorted by grid cell (CSR like the sibling lists), so the
+    # places of a row of cells are one slice. Nearest neighbor queries search growing
+    # squares of cells around the query point, which takes a few cells per query instead
+    # of a scan over every place. Query points are xyz (or xy) positions, or arrays of them
+    # for batches, results are dense node indices of C.
+    def __init__(self, C, cell_size=None):
+        self.C = C
+        self._cell_size = cell_size
+        self._build()
+
+    def _build(self):
+        C = self.C
+        self.num_nodes = len(C)
+        self.places = C.layer_nodes(dsg.DsgLayers.PLACES)
+        self.points = np.asarray(C.positions[self.places], dtype=float)
+        rooms = C.layer_nodes(dsg.DsgLayers.ROOMS)
+        rooms = rooms[np.all(np.isfinite(C.bbox_min[rooms]) & np.isfinite(C.bbox_max[rooms]), axis=1)]
+        self.rooms = rooms
+        self.room_min = np.asarray(C.bbox_min[rooms, :2], dtype=float)
+        self.room_max = np.asarray(C.bbox_max[rooms, :2], dtype=float)
+
+        corners = np.vstack((self.points[:, :2], self.room_min, self.room_max))
+        if len(corners) == 0:
+            raise Exception("No places or rooms to index")
+        lo, hi = corners.min(axis=0), corners.max(axis=0)
+        if self._cell_size is None:
+            # about 4 places per cell
+            area = np.prod(np.maximum(hi - lo, 1e-3))
+            self._cell_size = 2. * np.sqrt(area / max(len(self.places), 1))
+        self.cell_size = float(self._cell_size)
+        self.origin = lo
+        self.shape = (np.floor((hi - lo) / self.cell_size).astype(np.int64) + 1).tolist()
+        num_cells = self.shape[0] * self.shape[1]
+
+        # places sorted by flat cell index cx * ny + cy, a column of cells is one contiguous slice
+        cells = self._cells_of(self.points[:, :2])
+        flat = cells[:, 0] * self.shape[1] + cells[:, 1]
+        self._cell_places = np.argsort(flat, kind="stable")
+        self._cell_indptr = np.concatenate(([0], np.cumsum(np.bincount(flat, minlength=num_cells)))).tolist()
+
+        # rooms of every cell their bounding box overlaps
+        room_cells = [[] for _ in range(num_cells)]
+        cells_min, cells_max = self._cells_of(self.room_min), self._cells_of(self.room_max)
+        for room, (cx0, cy0), (cx1, cy1) in zip(range(len(rooms)), cells_min.tolist(), cells_max.tolist()):
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    room_cells[cx * self.shape[1] + cy].append(room)
+        self._room_indptr = np.concatenate(([0], np.cumsum([len(cell) for cell in room_cells]))).astype(np.int64)
+        self._room_indices = np.array([room for cell in room_cells for room in cell], dtype=np.int64)
+        self._room_areas = np.prod(self.room_max - self.room_min, axis=1)
+
+    def _check_version(self):
+        # only added nodes move the places around, edge edits keep the index valid
+        if len(self.C) != self.num_nodes:
+            self._build()
+
+    def _cells_of(self, xy):
+        cells = np.floor((np.asarray(xy, dtype=float) - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, np.array(self.shape) - 1).reshape(-1, 2)
+
+    def _in_cells(self, cx0, cx1, cy0, cy1):
+        # positions in self.places of the places in the rectangle of cells (clipped to the grid)
+        cx0, cy0 = max(cx0, 0), max(cy0, 0)
+        cx1, cy1 = min(cx1, self.shape[0] - 1), min(cy1, self.shape[1] - 1)
+        slices = [self._cell_places[self._cell_indptr[cx * self.shape[1] + cy0]:self._cell_indptr[cx * self.shape[1] + cy1 + 1]]
+                  for cx in range(cx0, cx1 + 1)]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def _dists(self, candidates, point):
+        return np.linalg.norm(self.points[candidates, :len(point)] - point, ord=2, axis=1)
+
+    def _k_nearest(self, point, k):
+        (cx, cy), = self._cells_of(point[:2]).tolist()
+        max_radius = max(self.shape)
+        radius = 0
+        while True:
+            candidates = self._in_cells(cx - radius, cx + radius, cy - radius, cy + radius)
+            # every place outside the square of cells is farther than radius cells from the point
+            if len(candidates) >= k or radius >= max_radius:
+                dists = self._dists(candidates, point)
+                order = np.argsort(dists, kind="stable")[:k]
+                # no candidates at all on a map without places (or k=0): empty arrays
+                if len(order) == 0 or radius >= max_radius or dists[order[-1]] <= radius * self.cell_size:
+                    return self.places[candidates[order]], dists[order]
+            radius += 1
+
+    def _within_radius(self, point, radius):
+        (cx0, cy0), (cx1, cy1) = self._cells_of(np.stack((point[:2] - radius, point[:2] + radius))).tolist()
+        candidates = self._in_cells(cx0, cx1, cy0, cy1)
+        dists = self._dists(candidates, point)
+        order = np.argsort(dists, kind="stable")
+        order = order[dists[order] <= radius]
+        return self.places[candidates[order]], dists[order]
+
+    def _room_at(self, point):
+        cell = np.floor((point[:2] - self.origin) / self.cell_size).astype(np.int64)
+        if np.any(cell < 0) or np.any(cell >= self.shape):
+            return -1
+        flat = cell[0] * self.shape[1] + cell[1]
+        candidates = self._room_indices[self._room_indptr[flat]:self._room_indptr[flat + 1]]
+        inside = candidates[np.all((self.room_min[candidates] <= point[:2]) & (point[:2] <= self.room_max[candidates]), axis=1)]
+        if len(inside) == 0:
+            return -1
+        # overlapping boxes: the smallest room is the most specific one
+        return int(self.rooms[inside[np.argmin(self._room_areas[inside])]])
+
+    def k_nearest(self, xyz, k):
+        # (places, distances) of the k closest places, sorted by distance, (n, k) arrays for a batch
+        self._check_version()
+        xyz = np.asarray(xyz, dtype=float)
+        k = min(k, len(self.places))
+        if xyz.ndim == 1:
+            return self._k_nearest(xyz, k)
+        results = [self._k_nearest(point, k) for point in xyz]
+        return np.array([places for places, _ in results], dtype=np.int64).reshape(len(xyz), k), np.array([dists for _, dists in results], dtype=float).reshape(len(xyz), k)
+
+    def nearest_place(self, xyz):
+        # closest place to a position, or array of them for a batch
+        places, _ = self.k_nearest(xyz, 1)
+        return int(places[0]) if np.ndim(xyz) == 1 else places[:, 0]
+
+    def within_radius(self, xyz, radius):
+        # (places, distances) of every place within radius, sorted by distance, lists of them for a batch
+        self._check_version()
+        xyz = np.asarray(xyz, dtype=float)
+        if xyz.ndim == 1:
+            return self._within_radius(xyz, radius)
+        results = [self._within_radius(point, radius) for point in xyz]
+        return [places for places, _ in results], [dists for _, dists in results]
+
+    def room_at(self, xyz):
+        # room whose bounding box contains the xy position, -1 if none does, array for a batch
+        self._check_version()
+        if len(self.rooms) == 0:
+            raise Exception("No room bounding boxes, call add_bounding_boxes_to_layer before compiling the graph")
+        xyz = np.asarray(xyz, dtype=float)
+        if xyz.ndim == 1:
+            return self._room_at(xyz)
+        return np.array([self._room_at(point) for point in xyz], dtype=np.int64)
+
+
+def build_spatial_index(G, cell_size=None):
+    if isinstance(G, CompiledGraph):
+        return SpatialIndex(G, cell_size)
+    dsg.add_bounding_boxes_to_layer(G, dsg.DsgLayers.ROOMS)
+    return SpatialIndex(compile_graph(G), cell_size)
+
+
+if __name__ == "__main__":
+    from planning_index import load_planning_index
+    np.random.seed(0)
+    N = 1000
+
+    path_to_dsg = "./DSGs/uhumans2/backend/dsg.json"
+    path_to_dsg = pathlib.Path(path_to_dsg).expanduser().absolute()
+    C = load_planning_index(path_to_dsg)
+
+    t0 = time.perf_counter()
+    index = build_spatial_index(C)
+    print(f"Spatial index: {time.perf_counter() - t0:.5f} sec, {index.shape[0]}x{index.shape[1]} cells of {index.cell_size:.2f} m")
+
+    # robot poses scattered around the places
+    poses = index.points[np.random.randint(0, len(index.points), N)] + np.random.normal(0., 1., (N, 3))
+    t0 = time.perf_counter()
+    scan = np.array([index.places[np.argmin(np.linalg.norm(index.points - pose, ord=2, axis=1))] for pose in poses])
+    scan_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    nearest = index.nearest_place(poses)
+    index_time = time.perf_counter() - t0
+    print(f"Nearest place, linear scan: {N / scan_time:.1f} queries/sec")
+    print(f"Nearest place, spatial index: {N / index_time:.1f} queries/sec, agrees with the scan for {np.mean(scan == nearest):.1%}")
+    t0 = time.perf_counter()
+    rooms = index.room_at(poses)
+    print(f"Room at pose: {N / (time.perf_counter() - t0):.1f} queries/sec, {np.mean(rooms >= 0):.1%} of poses inside a room")